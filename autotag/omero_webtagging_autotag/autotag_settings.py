@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+from omeroweb.settings import parse_boolean, process_custom_settings, report_settings
+
+# Settings can be changed with e.g.
+# omero config set omero.web.autotag.page_size 500
+AUTOTAG_SETTINGS_MAPPINGS = {
+    "omero.web.autotag.page_size": [
+        "PAGE_SIZE",
+        1000,
+        int,
+        "Number of images per page when streaming image details and tags.",
+    ],
+    "omero.web.autotag.query_batch_size": [
+        "QUERY_BATCH_SIZE",
+        1000,
+        int,
+        "Maximum number of ids bound to a single IN list in a query.",
+    ],
+    "omero.web.autotag.link_batch_size": [
+        "LINK_BATCH_SIZE",
+        1000,
+        int,
+        "Maximum number of tag links saved in a single request.",
+    ],
+    "omero.web.autotag.query_workers": [
+        "QUERY_WORKERS",
+        4,
+        int,
+        "Number of threads used to run batches of a query concurrently.",
+    ],
+    "omero.web.autotag.job_workers": [
+        "JOB_WORKERS",
+        2,
+        int,
+        "Number of threads applying tag updates submitted with async.",
+    ],
+    "omero.web.autotag.max_update_size": [
+        "MAX_UPDATE_SIZE",
+        100000,
+        int,
+        (
+            "Maximum number of image and tag pairs in an update of image ids "
+            "by tag, counting every image id in a range, or of image ids to "
+            "preview rules on."
+        ),
+    ],
+    "omero.web.autotag.tag_cache_ttl": [
+        "TAG_CACHE_TTL",
+        300,
+        int,
+        "Seconds to cache the tags of a group for. 0 disables the cache.",
+    ],
+    "omero.web.autotag.metrics": [
+        "METRICS",
+        "false",
+        parse_boolean,
+        (
+            "Whether to serve query and request timings for Prometheus at "
+            "autotag/metrics/."
+        ),
+    ],
+}
+
+process_custom_settings(sys.modules[__name__], "AUTOTAG_SETTINGS_MAPPINGS")
+report_settings(sys.modules[__name__])
@@ -0,0 +1,353 @@
+from builtins import str, object
+from array import array
+from bisect import bisect_left
+from operator import itemgetter
+
+
+class BlitzSet(object):
+    """
+    Custom set to contain omero blitz objects using the id as the unique
+    identifier.
+
+    This has a subset of set operations
+
+    Warning: This should not be used as-is for sets of objects that do not
+    have ids yet (i.e. new objects). It should also not be used if there is
+    any manipulation of the ids within the blitz objects although I'm unsure
+    if there is ever likely to be any reason to do this.
+
+    Effort has been made to ensure that BlitzSet behaves the same as the python
+    built-in set. For example, adding an item to a set which already exists
+    results in the original item being kept and the new item being discarded.
+    This could be important if using this set and manipulating the contents of
+    blitz objects. For example, the following example could happen:
+
+    tags = BlitzSet([])
+    tag1 = conn.getObject('TagAnnotation', 1)
+    tags.add(tag1)
+    tag2 = conn.getObject('TagAnnotation', 1)
+    tag2.setValue("TEST")
+    tags.add(tag2)
+
+    tag1 and tag2 are 2 completely separate objects that to BlitzSet are seen
+    as identical. In this case, the single item in the set would be tag1, not
+    tag2.
+
+    For large sets, CompactBlitzSet behaves the same but uses about half the
+    memory, at the cost of slower membership checks.
+
+    """
+
+    def __init__(self, s=[]):
+
+        self.__items = dict((self.__item_key(i), i) for i in s)
+
+    def __item_key(self, item):
+        return item.getId()
+
+    def add(self, item):
+        """
+        Add item to set
+
+        To be consistent with python set, do not overwrite existing items
+        """
+
+        if not self.__contains__(item):
+            self.__items[self.__item_key(item)] = item
+
+    def remove(self, item):
+        """
+        Remove item from set
+        """
+
+        del self.__items[self.__item_key(item)]
+
+    def update(self, items):
+        """
+        Add a collection of items to the set
+
+        Unlike add, update overwrites existing items
+        """
+
+        for item in items:
+            self.__items[self.__item_key(item)] = item
+
+    def union(self, other):
+        """
+        Union of this set with specified other set
+
+        To be consistent with python set, self overrides other
+        """
+
+        uni = BlitzSet()
+        uni.__items = dict(other.__items, **self.__items)
+        return uni
+
+    def __or__(self, other):
+        """
+        Union using || operator
+        """
+
+        return self.union(other)
+
+    def intersection(self, other):
+        """
+        Intersection of this set with specified other set
+
+        To be consistent with python set, shorter list overrides
+        or the other set if equal length
+        """
+
+        # Determine shorter list for iteration
+        if len(self.__items) < len(other.__items):
+            s1 = self.__items
+            s2 = other.__items
+        else:
+            s1 = other.__items
+            s2 = self.__items
+
+        # Compute the intersection
+        inter = BlitzSet()
+        for k in s1.keys():
+            if k in s2:
+                inter.add(s1[k])
+        return inter
+
+    def __and__(self, other):
+        """
+        Intersection using && operator
+        """
+
+        return self.intersection(other)
+
+    def difference(self, other):
+        """
+        Difference of this set and specified other set
+        """
+
+        inter = BlitzSet()
+        for k in self.__items.keys():
+            if k not in other.__items:
+                inter.add(self.__items[k])
+        return inter
+
+    def __sub__(self, other):
+        """
+        Difference using - operator
+        """
+
+        return self.difference(other)
+
+    def symmetric_difference(self, other):
+        """
+        Symmetric difference of this set and specified other set
+        """
+
+        # TODO Performance wise, probably not optimal
+        diff1 = self.difference(other)
+        diff2 = other.difference(self)
+        return diff1.union(diff2)
+
+    def __xor__(self, other):
+        """
+        Symmetric difference using ^ operator
+        """
+
+        return self.symmetric_difference(other)
+
+    def __str__(self):
+        return str(list(self.__items.values()))
+
+    def __contains__(self, item):
+        return self.__item_key(item) in self.__items
+
+    def __iter__(self):
+        return iter(self.__items.values())
+
+    def __len__(self):
+        return len(self.__items)
+
+
+class CompactBlitzSet(object):
+    """
+    BlitzSet holding its items in a list ordered by id, alongside a sorted
+    array of the ids
+
+    This takes about half the memory of BlitzSet for large sets, but
+    membership is checked by bisecting the ids, which is several times slower
+    than the dict lookup of BlitzSet. Set operations are done on sets of the
+    ids, looking the items of the result up in a temporary dict. Items added
+    are buffered until the set is next read, so that adding many items does
+    not shift the array for each. Which item is kept for an id is the same as
+    for BlitzSet and the python built-in set.
+
+    The same warnings as for BlitzSet apply.
+    """
+
+    def __init__(self, s=[]):
+
+        self.__set_items({self.__item_key(i): i for i in s})
+
+    def __item_key(self, item):
+        return item.getId()
+
+    def __set_items(self, items, keys=None):
+        """
+        Replace the contents with items, a dict of id -> item, restricted to
+        keys if specified
+        """
+
+        keys = sorted(items if keys is None else keys)
+        self.__ids = array("q", keys)
+        if len(keys) > 1:
+            self.__items = list(itemgetter(*keys)(items))
+        else:
+            self.__items = [items[k] for k in keys]
+        # Items added since the ids were last sorted, id -> item
+        self.__added = {}
+
+    def __table(self):
+        return dict(zip(self.__ids, self.__items))
+
+    def __flush(self):
+        # Merge any added items into the sorted ids, existing items winning
+        if self.__added:
+            items = self.__added
+            items.update(zip(self.__ids, self.__items))
+            self.__set_items(items)
+
+    def __result(self, items, keys=None):
+        result = CompactBlitzSet()
+        result.__set_items(items, keys)
+        return result
+
+    def add(self, item):
+        """
+        Add item to set
+
+        To be consistent with python set, do not overwrite existing items
+        """
+
+        self.__added.setdefault(self.__item_key(item), item)
+
+    def remove(self, item):
+        """
+        Remove item from set
+        """
+
+        self.__flush()
+        key = self.__item_key(item)
+        i = bisect_left(self.__ids, key)
+        if i == len(self.__ids) or self.__ids[i] != key:
+            raise KeyError(key)
+        del self.__ids[i]
+        del self.__items[i]
+
+    def update(self, items):
+        """
+        Add a collection of items to the set
+
+        Unlike add, update overwrites existing items
+        """
+
+        self.__flush()
+        table = self.__table()
+        table.update((self.__item_key(item), item) for item in items)
+        self.__set_items(table)
+
+    def union(self, other):
+        """
+        Union of this set with specified other set
+
+        To be consistent with python set, self overrides other
+        """
+
+        self.__flush()
+        other.__flush()
+        items = other.__table()
+        items.update(zip(self.__ids, self.__items))
+        return self.__result(items)
+
+    def __or__(self, other):
+        """
+        Union using || operator
+        """
+
+        return self.union(other)
+
+    def intersection(self, other):
+        """
+        Intersection of this set with specified other set
+
+        To be consistent with python set, shorter list overrides
+        or the other set if equal length
+        """
+
+        self.__flush()
+        other.__flush()
+        if len(self.__ids) < len(other.__ids):
+            s1, s2 = self, other
+        else:
+            s1, s2 = other, self
+        keys = set(s1.__ids).intersection(s2.__ids)
+        return self.__result(s1.__table(), keys)
+
+    def __and__(self, other):
+        """
+        Intersection using && operator
+        """
+
+        return self.intersection(other)
+
+    def difference(self, other):
+        """
+        Difference of this set and specified other set
+        """
+
+        self.__flush()
+        other.__flush()
+        keys = set(self.__ids).difference(other.__ids)
+        return self.__result(self.__table(), keys)
+
+    def __sub__(self, other):
+        """
+        Difference using - operator
+        """
+
+        return self.difference(other)
+
+    def symmetric_difference(self, other):
+        """
+        Symmetric difference of this set and specified other set
+        """
+
+        self.__flush()
+        other.__flush()
+        keys = set(self.__ids).symmetric_difference(other.__ids)
+        items = other.__table()
+        items.update(zip(self.__ids, self.__items))
+        return self.__result(items, keys)
+
+    def __xor__(self, other):
+        """
+        Symmetric difference using ^ operator
+        """
+
+        return self.symmetric_difference(other)
+
+    def __str__(self):
+        return str(list(self))
+
+    def __contains__(self, item):
+        key = self.__item_key(item)
+        ids = self.__ids
+        i = bisect_left(ids, key)
+        return (i < len(ids) and ids[i] == key) or key in self.__added
+
+    def __iter__(self):
+        self.__flush()
+        return iter(self.__items)
+
+    def __len__(self):
+        self.__flush()
+        return len(self.__ids)
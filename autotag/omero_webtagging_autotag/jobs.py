@@ -0,0 +1,182 @@
+from builtins import object
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import uuid
+from django.core.cache import cache
+from . import autotag_settings
+from .rules import apply_rules
+from .utils import batches, createTagAnnotationsLinks
+
+logger = logging.getLogger(__name__)
+
+# Jobs are kept this long (seconds) after their progress last changed for
+# it to be polled
+JOB_EXPIRY = 3600
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _job_key(job_id):
+    return "omero_webtagging_autotag:job:%s" % job_id
+
+
+class UpdateJob(object):
+    """
+    Progress of a tag update being applied in the background
+
+    The total is None for an update whose size is not known until it has
+    been applied, e.g. that of rules applied to a container
+
+    The job runs in a thread of the web server process which it was submitted
+    to, but its progress may be polled through any, so it is saved in the
+    Django cache whenever it changes
+    """
+
+    def __init__(self, user_id, total=None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.status = "queued"
+        self.total = total
+        # Number of images rules have been applied to, if any
+        self.images = None
+        self.counts = {
+            "added": 0,
+            "existing": 0,
+            "failed": 0,
+            "removed": 0,
+            "missing": 0,
+        }
+        self.error = None
+
+    def save(self):
+        cache.set(
+            _job_key(self.id),
+            {"user_id": self.user_id, "job": self.to_dict()},
+            JOB_EXPIRY,
+        )
+
+    def to_dict(self):
+        d = {
+            "jobId": self.id,
+            "status": self.status,
+            "total": self.total,
+            # Everything processed, whether or not it succeeded
+            "applied": sum(self.counts.values()),
+            "images": self.images,
+            "error": self.error,
+        }
+        d.update(self.counts)
+        return d
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=autotag_settings.JOB_WORKERS)
+        return _executor
+
+
+def _run(job, connect, work, *args):
+    job.status = "running"
+    job.save()
+    conn = None
+    try:
+        # The connection of the request which submitted the job may already
+        # be closed, so the job needs its own
+        conn = connect()
+        work(job, conn, *args)
+        job.status = "done"
+    except Exception as e:
+        logger.exception("Tag update job %s failed", job.id)
+        job.error = str(e)
+        job.status = "failed"
+    finally:
+        job.save()
+        if conn is not None:
+            conn.close(hard=False)
+
+
+def _apply_update(job, conn, additions, removals):
+    size = autotag_settings.LINK_BATCH_SIZE
+    for batch in batches(additions, size):
+        _apply(job, conn, batch, [])
+    for batch in batches(removals, size):
+        _apply(job, conn, [], batch)
+
+
+def _apply_rules(job, conn, container_type, container_id, rules):
+    def progress(counts):
+        job.images = counts["images"]
+        for key in job.counts:
+            job.counts[key] = counts[key]
+        job.save()
+
+    apply_rules(conn, container_type, container_id, rules, progress=progress)
+
+
+def _apply(job, conn, additions, removals):
+    try:
+        result = createTagAnnotationsLinks(conn, additions, removals)
+    except Exception as e:
+        # Carry on with the other batches, but count this one as failed
+        logger.exception("Tag update job %s failed to apply a batch", job.id)
+        job.error = str(e)
+        job.counts["failed"] += len(additions) + len(removals)
+    else:
+        for key in job.counts:
+            job.counts[key] += result[key]
+    job.save()
+
+
+def submit(user_id, connect, additions, removals):
+    """
+    Apply the additions and removals in the background
+
+    @param user_id:         The user submitting the job, who alone may poll it
+    @param connect:         Callable returning a connection for the job to use,
+                            which the job closes when finished
+    @param additions:       List of (image id, tag id) to link
+    @param removals:        List of (image id, tag id) to unlink
+    @return:                The UpdateJob
+    """
+
+    job = UpdateJob(user_id, len(additions) + len(removals))
+    return _submit(job, connect, _apply_update, additions, removals)
+
+
+def submit_rules(user_id, connect, container_type, container_id, rules):
+    """
+    Apply rules to all the images in a container in the background
+
+    @param container_type:  "Dataset", "Project" or "Plate"
+    @param rules:           List of matching.Rule
+    @return:                The UpdateJob
+
+    The other parameters are as for submit
+    """
+
+    job = UpdateJob(user_id)
+    return _submit(job, connect, _apply_rules, container_type, container_id, rules)
+
+
+def _submit(job, connect, work, *args):
+    job.save()
+    _get_executor().submit(_run, job, connect, work, *args)
+    return job
+
+
+def get_job(job_id, user_id):
+    """
+    Get the progress of a job submitted by the specified user
+
+    @return:                Dict of the progress, as UpdateJob.to_dict, or
+                            None if there is no such job
+    """
+
+    saved = cache.get(_job_key(job_id))
+    if saved is None or saved["user_id"] != user_id:
+        return None
+    return saved["job"]
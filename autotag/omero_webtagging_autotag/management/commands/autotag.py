@@ -0,0 +1,182 @@
+import csv
+import json
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from omero.gateway import BlitzGateway
+from ...matching import Rule, parse_rules
+from ...rules import CONTAINER_IMAGES, apply_rules
+
+
+def read_mapping(path):
+    """
+    Read the rules in a mapping file
+
+    A .json file has either an object of token -> tag id or a list of rules
+    as for matching.parse_rules. Any other file has a token and a tag id on each
+    line, separated by a tab in a .tsv file or a comma otherwise, and may have
+    # comments.
+    """
+
+    try:
+        with open(path) as f:
+            if path.endswith(".json"):
+                mapping = json.load(f)
+                if isinstance(mapping, dict):
+                    return [Rule(t, token=token) for token, t in mapping.items()]
+                return parse_rules(mapping)
+
+            rules = []
+            lines = (line for line in f if line.strip() and not line.startswith("#"))
+            dialect = "excel-tab" if path.endswith(".tsv") else "excel"
+            for row in csv.reader(lines, dialect):
+                if len(row) != 2:
+                    raise ValueError("Expected a token and a tag id: %s" % row)
+                rules.append(Rule(row[1].strip(), token=row[0].strip()))
+            return rules
+    except (IOError, ValueError) as e:
+        raise CommandError("Invalid mapping file %s: %s" % (path, e))
+
+
+def parse_container(container):
+    """
+    Parse a container of the form Type:id, e.g. Dataset:1
+    """
+
+    try:
+        container_type, container_id = container.split(":")
+        container_id = int(container_id)
+    except ValueError:
+        raise CommandError("Container must be Type:id, e.g. Dataset:1")
+    if container_type not in CONTAINER_IMAGES:
+        raise CommandError(
+            "Container type must be one of %s" % ", ".join(sorted(CONTAINER_IMAGES))
+        )
+    return container_type, container_id
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply tags to all the images in a Dataset, Project or Plate according "
+        "to a mapping of the tokens of their paths to tags"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("container", help="Container to tag, e.g. Dataset:1")
+        parser.add_argument(
+            "mapping",
+            help=(
+                "File of tokens and tag ids, either token,tag id lines or a "
+                ".json object of token: tag id or list of rules"
+            ),
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Count the images and matches without tagging anything",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Links saved per request (default omero.web.autotag.link_batch_size)",
+        )
+        parser.add_argument(
+            "--parallelism",
+            type=int,
+            default=1,
+            help="Number of batches of links saved concurrently",
+        )
+        parser.add_argument("--host", default="localhost", help="OMERO server")
+        parser.add_argument("--port", type=int, default=4064)
+        parser.add_argument("--user", help="User to log in as")
+        parser.add_argument(
+            "--password",
+            help="Password of the user, by default $OMERO_PASSWORD",
+        )
+        parser.add_argument(
+            "--session-key",
+            help="Join this session instead of logging in, by default "
+            "$OMERO_SESSION_KEY",
+        )
+
+    def connect(self, options, session_key):
+        if session_key:
+            conn = BlitzGateway(host=options["host"], port=options["port"])
+            connected = conn.connect(sUuid=session_key)
+        else:
+            password = options["password"] or os.environ.get("OMERO_PASSWORD")
+            if not options["user"] or not password:
+                raise CommandError("--user and a password or a session key required")
+            conn = BlitzGateway(
+                options["user"],
+                password,
+                host=options["host"],
+                port=options["port"],
+                secure=True,
+            )
+            connected = conn.connect()
+        if not connected:
+            raise CommandError("Unable to connect to %s" % options["host"])
+        # Find the container in any group
+        conn.SERVICE_OPTS.setOmeroGroup(-1)
+        return conn
+
+    def handle(self, *args, **options):
+        container_type, container_id = parse_container(options["container"])
+        rules = read_mapping(options["mapping"])
+        if not rules:
+            raise CommandError("No rules in %s" % options["mapping"])
+        if options["parallelism"] < 1:
+            raise CommandError("--parallelism must be at least 1")
+
+        session_key = options["session_key"] or os.environ.get("OMERO_SESSION_KEY")
+        conn = self.connect(options, session_key)
+        try:
+            container = conn.getObject(container_type, container_id)
+            if container is None:
+                raise CommandError("No such %s" % options["container"])
+            conn.SERVICE_OPTS.setOmeroGroup(container.getDetails().getGroup().getId())
+
+            start = time.time()
+
+            def progress(counts):
+                elapsed = max(time.time() - start, 1e-6)
+                self.stdout.write(
+                    "%(images)s images, %(matched)s matched, %(added)s added, "
+                    "%(existing)s existing, %(failed)s failed" % counts
+                    + " (%.0f images/s)" % (counts["images"] / elapsed)
+                )
+
+            counts = apply_rules(
+                conn,
+                container_type,
+                container_id,
+                rules,
+                dry_run=options["dry_run"],
+                progress=progress,
+                batch_size=options["batch_size"],
+                workers=options["parallelism"],
+            )
+        finally:
+            # Only end the session if it was created by this command, not one
+            # of another client which was joined
+            conn.close(hard=not session_key)
+
+        elapsed = max(time.time() - start, 1e-6)
+        self.stdout.write(
+            self.style.SUCCESS(
+                "%s %s images in %.1fs: %s matched, %s added, %s existing, "
+                "%s failed (%.0f links/s)"
+                % (
+                    "Checked" if options["dry_run"] else "Tagged",
+                    counts["images"],
+                    elapsed,
+                    counts["matched"],
+                    counts["added"],
+                    counts["existing"],
+                    counts["failed"],
+                    counts["added"] / elapsed,
+                )
+            )
+        )
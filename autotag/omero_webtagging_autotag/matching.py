@@ -0,0 +1,152 @@
+from builtins import object
+import re
+from .tokens import tokenize_path
+
+# The fields of an image which rules can match
+FIELDS = ("clientPath", "name")
+
+
+class Rule(object):
+    """
+    Rule applying a tag to the images with a token in, or a match of a
+    regular expression in, one of their fields
+
+    Tokens are those of tokenize_path, as they are in the browser
+
+    @param tag_id:          The tag to apply
+    @param token:           The token which must be in the field
+    @param regex:           The regular expression which must match some of
+                            the field, if no token is specified
+    @param field:           "clientPath" or "name"
+    """
+
+    def __init__(self, tag_id, token=None, regex=None, field="clientPath"):
+        if (token is None) == (regex is None):
+            raise ValueError("Exactly one of token or regex is required")
+        if field not in FIELDS:
+            raise ValueError("Unknown field: %s" % field)
+        self.tag_id = int(tag_id)
+        self.token = token
+        self.regex = re.compile(regex) if regex is not None else None
+        self.field = field
+
+    def matches(self, image, tokens):
+        """
+        Whether the rule matches an image
+
+        @param image:       Dict of the image's id and fields
+        @param tokens:      Dict of field -> set of the tokens of the field
+        """
+
+        if self.token is not None:
+            return self.token in tokens[self.field]
+        return self.regex.search(image[self.field] or "") is not None
+
+
+def parse_rules(rules):
+    """
+    Parse a list of rules of the form
+    {"tagId": id, "token": token, "field": field} or
+    {"tagId": id, "regex": regex, "field": field} where field is optional
+
+    Raises ValueError if any of the rules is invalid
+    """
+
+    try:
+        return [
+            Rule(
+                rule["tagId"],
+                token=rule.get("token"),
+                regex=rule.get("regex"),
+                field=rule.get("field", "clientPath"),
+            )
+            for rule in rules
+        ]
+    except (KeyError, TypeError, AttributeError, re.error) as e:
+        raise ValueError("Invalid rule: %s" % e)
+
+
+def match_images(images, rules):
+    """
+    Get the tags matched by rules for each of a list of images
+
+    @return:                List of (image, sorted list of tag ids)
+    """
+
+    matched = []
+    for image in images:
+        tokens = dict((field, set(tokenize_path(image[field]))) for field in FIELDS)
+        tag_ids = set(rule.tag_id for rule in rules if rule.matches(image, tokens))
+        matched.append((image, sorted(tag_ids)))
+    return matched
+
+
+def diff_pages(pages, rules, get_tags, exact=False, offset=0, limit=100):
+    """
+    Get the links rules would add to, and remove from, images without
+    changing anything
+
+    By default, as in the browser, tags are only added to images matched by
+    their rules. If exact, tags are also removed from images which are not
+    matched by any of the rules for them, where the current user linked them,
+    as only those links could be deleted.
+
+    @param pages:           Iterable of lists of dicts of the id, name and
+                            clientPath of images
+    @param get_tags:        Function of (image ids, owned) returning a dict
+                            of image id -> ids of the tags linked to it, only
+                            by the current user if owned
+    @param offset:          Number of changed images to skip in the diff
+    @param limit:           Maximum number of changed images in the diff
+    @return:                Dict of the "summary" counts, overall and of each
+                            tag, and the "diff" of the requested changed
+                            images
+    """
+
+    rule_tags = set(rule.tag_id for rule in rules)
+    summary = {
+        "images": 0,
+        "changedImages": 0,
+        "additions": 0,
+        "removals": 0,
+        "tags": dict((tag_id, {"additions": 0, "removals": 0}) for tag_id in rule_tags),
+    }
+    diff = []
+
+    for page in pages:
+        image_ids = [image["id"] for image in page]
+        tags_on_images = get_tags(image_ids, False)
+        if exact:
+            owned_tags_on_images = get_tags(image_ids, True)
+        for image, tag_ids in match_images(page, rules):
+            tagged = rule_tags.intersection(tags_on_images.get(image["id"], ()))
+            additions = sorted(set(tag_ids) - tagged)
+            if exact:
+                owned = rule_tags.intersection(
+                    owned_tags_on_images.get(image["id"], ())
+                )
+                removals = sorted(owned - set(tag_ids))
+            else:
+                removals = []
+
+            summary["images"] += 1
+            if not additions and not removals:
+                continue
+            if offset <= summary["changedImages"] < offset + limit:
+                diff.append(
+                    {
+                        "imageId": image["id"],
+                        "name": image["name"],
+                        "additions": additions,
+                        "removals": removals,
+                    }
+                )
+            summary["changedImages"] += 1
+            summary["additions"] += len(additions)
+            summary["removals"] += len(removals)
+            for tag_id in additions:
+                summary["tags"][tag_id]["additions"] += 1
+            for tag_id in removals:
+                summary["tags"][tag_id]["removals"] += 1
+
+    return {"summary": summary, "diff": diff}
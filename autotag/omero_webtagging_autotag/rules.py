@@ -0,0 +1,196 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import omero
+from omero.rtypes import unwrap
+from . import autotag_settings
+from .matching import diff_pages, match_images
+from .timing import timed_query_service
+from .utils import (
+    batches,
+    chunked_projection,
+    createTagAnnotationsLinks,
+    get_tags_on_images,
+)
+
+# Queries of the ids of the images in each type of container which can be
+# auto-tagged
+CONTAINER_IMAGES = {
+    "Dataset": (
+        "select link.child.id from DatasetImageLink link where link.parent.id = :cid"
+    ),
+    "Project": (
+        "select dil.child.id from DatasetImageLink dil, ProjectDatasetLink pdl "
+        "where dil.parent.id = pdl.child.id "
+        "and pdl.parent.id = :cid"
+    ),
+    "Plate": ("select ws.image.id from WellSample ws where ws.well.plate.id = :cid"),
+}
+
+# Query of the fields of images matched by rules, given a condition
+IMAGES_QUERY = """
+        SELECT new map(image.id AS id,
+               image.name AS name,
+               filesetentry.clientPath AS clientPath)
+        FROM Image image
+        JOIN image.fileset fileset
+        JOIN fileset.usedFiles filesetentry
+        WHERE index(filesetentry) = 0
+        AND %s
+        ORDER BY image.id
+        """
+
+
+def iter_container_images(conn, container_type, container_id, page_size=None):
+    """
+    Generate the images in a container in pages, ordered by id
+
+    Each page is queried after the last id of the previous one, so that
+    every page costs the same however many there are
+
+    @param container_type:  One of CONTAINER_IMAGES
+    @return:                Generator of lists of dicts of the id, name and
+                            clientPath of the images
+    """
+
+    page_size = page_size or autotag_settings.PAGE_SIZE
+    q = IMAGES_QUERY % (
+        "image.id > :last AND image.id IN (%s)" % CONTAINER_IMAGES[container_type]
+    )
+
+    qs = timed_query_service(conn, "container_images")
+    last_id = -1
+    while True:
+        params = omero.sys.ParametersI()
+        params.addLong("cid", container_id)
+        params.addLong("last", last_id)
+        params.page(0, page_size)
+        images = [unwrap(e)[0] for e in qs.projection(q, params, conn.SERVICE_OPTS)]
+        if images:
+            yield images
+        if len(images) < page_size:
+            break
+        last_id = images[-1]["id"]
+
+
+def iter_images(conn, image_ids, page_size=None):
+    """
+    Generate the specified images in pages, ordered by id
+
+    @return:                Generator of lists of dicts of the id, name and
+                            clientPath of the images
+    """
+
+    page_size = page_size or autotag_settings.PAGE_SIZE
+    q = IMAGES_QUERY % "image.id IN (:iids)"
+
+    qs = timed_query_service(conn, "images")
+    for page_ids in batches(sorted(set(image_ids)), page_size):
+        images = [
+            unwrap(e)[0]
+            for e in chunked_projection(
+                qs, q, page_ids, conn.SERVICE_OPTS, key=_image_id
+            )
+        ]
+        if images:
+            yield images
+
+
+def _image_id(e):
+    return e[0].val["id"].val
+
+
+def apply_rules(
+    conn,
+    container_type,
+    container_id,
+    rules,
+    dry_run=False,
+    progress=None,
+    batch_size=None,
+    workers=1,
+):
+    """
+    Apply rules to all the images in a container
+
+    The images are streamed in pages of PAGE_SIZE and the links are saved in
+    batches with createTagAnnotationsLinks, so this can be used on any size
+    of container
+
+    @param dry_run:         Count the matches without linking anything
+    @param progress:        Function called with the counts after each page
+    @param batch_size:      Links saved per batch, LINK_BATCH_SIZE by default
+    @param workers:         Number of batches saved concurrently
+    @return:                Dict of counts of images, matched (image, tag)
+                            pairs and those of createTagAnnotationsLinks
+    """
+
+    batch_size = batch_size or autotag_settings.LINK_BATCH_SIZE
+    counts = {
+        "images": 0,
+        "matched": 0,
+        "added": 0,
+        "existing": 0,
+        "failed": 0,
+        "removed": 0,
+        "missing": 0,
+    }
+
+    def add(result):
+        for key in result:
+            counts[key] += result[key]
+
+    # Not the shared executor, as createTagAnnotationsLinks queries on that
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending = deque()
+    try:
+        for page in iter_container_images(conn, container_type, container_id):
+            additions = [
+                (image["id"], tag_id)
+                for image, tag_ids in match_images(page, rules)
+                for tag_id in tag_ids
+            ]
+            counts["images"] += len(page)
+            counts["matched"] += len(additions)
+            if not dry_run:
+                for batch in batches(additions, batch_size):
+                    if executor is None:
+                        add(createTagAnnotationsLinks(conn, batch))
+                        continue
+                    pending.append(
+                        executor.submit(createTagAnnotationsLinks, conn, batch)
+                    )
+                    # Bound the batches held in memory
+                    while len(pending) > 2 * workers:
+                        add(pending.popleft().result())
+            if progress is not None:
+                progress(dict(counts))
+        while pending:
+            add(pending.popleft().result())
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+    if executor is not None and progress is not None:
+        # Batches of the last pages completed after they were reported
+        progress(dict(counts))
+    return counts
+
+
+def diff_images(conn, pages, rules, exact=False, offset=0, limit=100):
+    """
+    Get the links rules would add to, and remove from, images without
+    changing anything
+
+    This only previews the removals of exact: applying rules, with
+    apply_rules, only ever adds tags. See matching.diff_pages.
+
+    @param pages:           Iterable of pages of images, as generated by
+                            iter_images or iter_container_images
+    """
+
+    qs = timed_query_service(conn, "diff_tags")
+
+    def get_tags(image_ids, owned):
+        owner_id = conn.getUserId() if owned else None
+        return get_tags_on_images(qs, image_ids, conn.SERVICE_OPTS, owner_id=owner_id)
+
+    return diff_pages(pages, rules, get_tags, exact, offset, limit)
@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# Sent after tag links have been created or deleted by autotag, so that
+# anything caching tag links can apply exactly those changes.
+#
+# Arguments: group_id, user_id and the lists of (image id, tag id) pairs which
+# were added and removed
+tag_links_changed = Signal()
@@ -0,0 +1,43 @@
+import re
+
+# Delimiters used to split a clientPath into tokens. This must be kept in line
+# with the tokenization in AutoTagForm.jsx
+TOKEN_DELIMITERS = re.compile(r"[\/\\_\.\s]+")
+
+
+def tokenize_path(path):
+    """
+    Split a clientPath into its tokens
+
+    Empty tokens (e.g. from a leading slash) are dropped as they can never be
+    mapped to a tag
+
+    @param path:            The clientPath to tokenize
+    """
+
+    if not path:
+        return []
+    return [token for token in TOKEN_DELIMITERS.split(path) if token]
+
+
+def build_token_index(images):
+    """
+    Build an inverted index of the tokens in a set of image paths
+
+    Counts are of token occurrences, so a token which appears twice in one
+    path counts twice, as it does in the browser
+
+    @param images:          Iterable of (image id, clientPath) pairs
+    @return:                Tuple of dicts: token -> [image ids] and
+                            token -> count
+    """
+
+    index = {}
+    counts = {}
+    for image_id, path in images:
+        for token in tokenize_path(path):
+            image_ids = index.setdefault(token, [])
+            if not image_ids or image_ids[-1] != image_id:
+                image_ids.append(image_id)
+            counts[token] = counts.get(token, 0) + 1
+    return index, counts
@@ -0,0 +1,97 @@
+"""
+Parsing of the tag updates posted to process_update
+"""
+
+from builtins import range
+
+
+class UpdateTooLarge(ValueError):
+    """
+    Raised when an update has more image ids than are allowed
+    """
+
+    def __init__(self, limit):
+        super(UpdateTooLarge, self).__init__(
+            "Too many image ids, the maximum is %s" % limit
+        )
+
+
+def parse_image_ids(image_ids, limit):
+    """
+    Expand a list of image ids where any item may be an inclusive
+    [start, end] range of ids
+
+    Ranges are checked before they are expanded, so that a request cannot
+    make the server hold more ids than it allows
+
+    @param limit:           Maximum number of ids, counting every id in a
+                            range. UpdateTooLarge is raised if there are more
+    """
+
+    count = 0
+    for image_id in image_ids:
+        if isinstance(image_id, list):
+            start, end = image_id
+            start, end = int(start), int(end)
+            if start > end:
+                raise ValueError("Invalid range: %s" % image_id)
+            count += end - start + 1
+            if count > limit:
+                raise UpdateTooLarge(limit)
+            for i in range(start, end + 1):
+                yield i
+        else:
+            count += 1
+            if count > limit:
+                raise UpdateTooLarge(limit)
+            yield int(image_id)
+
+
+def parse_update(update, limit):
+    """
+    Normalise either format of update into sorted lists of (image id, tag id)
+    to add and remove
+
+    The image-centric format is a list of
+    {"imageId": id, "additions": [tag ids], "removals": [tag ids]}
+
+    The tag-centric format is
+    {"additions": {tag id: [image ids]}, "removals": {tag id: [image ids]}}
+    where any of the image ids may be an inclusive [start, end] range
+
+    Any pair which is both added and removed is ignored. UpdateTooLarge is
+    raised if a tag-centric update has more than limit pairs, as its ranges
+    let a small request name any number of images. An image-centric update,
+    as sent by the form, lists every pair, so it is no larger than the
+    request and is not limited.
+    """
+
+    additions = set()
+    removals = set()
+
+    def remaining():
+        return limit - len(additions) - len(removals)
+
+    if isinstance(update, dict):
+        try:
+            for tag_id, image_ids in update.get("additions", {}).items():
+                tag_id = int(tag_id)
+                additions.update(
+                    (i, tag_id) for i in parse_image_ids(image_ids, remaining())
+                )
+            for tag_id, image_ids in update.get("removals", {}).items():
+                tag_id = int(tag_id)
+                removals.update(
+                    (i, tag_id) for i in parse_image_ids(image_ids, remaining())
+                )
+        except UpdateTooLarge:
+            # With the limit of the whole update, not what was left of it
+            raise UpdateTooLarge(limit)
+    else:
+        for image in update:
+            image_id = int(image["imageId"])
+            additions.update((image_id, int(tag_id)) for tag_id in image["additions"])
+            removals.update((image_id, int(tag_id)) for tag_id in image["removals"])
+
+    conflicts = additions & removals
+    return sorted(additions - conflicts), sorted(removals - conflicts)
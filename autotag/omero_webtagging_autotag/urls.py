@@ -1,5 +1,5 @@
 from django.conf.urls import url
-from . import views
+from . import timing, views
 
 urlpatterns = [
     url(
@@ -7,12 +7,38 @@ urlpatterns = [
         views.get_image_detail_and_tags,
         name="webtagging_get_image_detail_and_tags",
     ),
+    # NDJSON streaming variant for large selections
+    url(
+        r"^get_image_detail_and_tags/stream/$",
+        views.stream_image_detail_and_tags,
+        name="webtagging_stream_image_detail_and_tags",
+    ),
     # process main form submission
     url(
         r"^auto_tag/processUpdate/$",
         views.process_update,
         name="webtagging_process_update",
     ),
+    # apply rules to all the images in a container in the background
+    url(
+        r"^auto_tag/rules/$",
+        views.apply_container_rules,
+        name="webtagging_apply_rules",
+    ),
+    # what rules would change, without changing anything
+    url(
+        r"^auto_tag/diff/$",
+        views.diff_rules,
+        name="webtagging_diff_rules",
+    ),
+    # progress of a main form submission made with async, or of rules
+    url(
+        r"^auto_tag/processUpdate/(?P<job_id>[0-9a-f]+)/$",
+        views.process_update_progress,
+        name="webtagging_process_update_progress",
+    ),
     # Create tags for tags dialog
     url(r"^create_tag/$", views.create_tag, name="webtagging_create_tag"),
+    # Query and request timings for Prometheus
+    url(r"^metrics/$", timing.metrics, name="webtagging_metrics"),
 ]
@@ -1,225 +1,291 @@
-from builtins import str, zip, object
+from builtins import range, map
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from django.core.cache import cache
 import omero
-from omero.rtypes import rlong
+from omeroweb.webclient import tree
+from . import autotag_settings
 
+# BlitzSet and CompactBlitzSet used to be defined here
+from .blitzset import BlitzSet, CompactBlitzSet  # noqa: F401
+from .signals import tag_links_changed
+from .timing import timed_query_service
 
-def createTagAnnotationsLinks(conn, additions=[], removals=[]):
-    """
-    Links or unlinks existing Images with existing Tag annotations
 
-    @param additions:       List of tags to add to images
-    @param additions:       List of tags to remove from images
+def batches(items, size):
+    """
+    Split a list into consecutive batches of at most size items
     """
 
-    newLinks = []
-    # Create a list of links to apply
-    for addition in additions:
-        link = omero.model.ImageAnnotationLinkI()
-        link.parent = omero.model.ImageI(addition[0], False)
-        link.child = omero.model.TagAnnotationI(addition[1], False)
-        newLinks.append(link)
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
 
-    # Apply the links
-    failed = 0
-    savedLinks = []
-    try:
-        # will fail if any of the links already exist
-        savedLinks = conn.getUpdateService().saveAndReturnArray(
-            newLinks, conn.SERVICE_OPTS
-        )
-    except omero.ValidationException:
-        # This will occur if the user has modified the tag landscape outside
-        # of the auto-tagger while using the auto-tagger. Not likely to often
-        # happen, but very possible.
-
-        for link in newLinks:
-            try:
-                savedLinks.append(
-                    conn.getUpdateService().saveAndReturnObject(link, conn.SERVICE_OPTS)
-                )
-            except omero.ValidationException:
-                failed += 1
-
-    if len(removals) > 0:
-        # Get existing links belonging to current user (all at once to save
-        # on queries)
-        allImageIds, allTagIds = list(zip(*removals))
-
-        params = omero.sys.Parameters()
-        params.theFilter = omero.sys.Filter()
-        params.theFilter.ownerId = rlong(conn.getUserId())
-        # This query gets all the relationships between these images and these
-        # tags, otherwise we'd have to get them individually.
-        links = conn.getAnnotationLinks(
-            "Image",
-            parent_ids=list(allImageIds),
-            ann_ids=list(allTagIds),
-            params=params,
-        )
 
-        # The above returns more image->tag links that were specified for
-        # deletion, so only delete the appropriate ones
-        for link in links:
-            if (link.parent.id.val, link.child.id.val) in removals:
-                conn.deleteObjectDirect(link._obj)
+_executor = None
+_executor_lock = threading.Lock()
 
 
-class BlitzSet(object):
+def get_executor():
+    """
+    Get the thread pool shared by chunked queries, creating it if necessary
     """
-    Custom set to contain omero blitz objects using the id as the unique
-    identifier.
 
-    This has a subset of set operations
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=autotag_settings.QUERY_WORKERS)
+        return _executor
 
-    Warning: This should not be used as-is for sets of objects that do not
-    have ids yet (i.e. new objects). It should also not be used if there is
-    any manipulation of the ids within the blitz objects although I'm unsure
-    if there is ever likely to be any reason to do this.
 
-    Effort has been made to ensure that BlitzSet behaves the same as the python
-    built-in set. For example, adding an item to a set which already exists
-    results in the original item being kept and the new item being discarded.
-    This could be important if using this set and manipulating the contents of
-    blitz objects. For example, the following example could happen:
+def chunked_projection(qs, q, ids, service_opts, name="iids", params=None, key=None):
+    """
+    Run a projection which has a large IN list of ids in batches
+
+    The ids are bound in batches of at most QUERY_BATCH_SIZE and the batches
+    are run concurrently. If key is specified, all the results are sorted by
+    it, otherwise they are concatenated in batch order. The ORDER BY of the
+    query only orders each batch, and the database may collate differently
+    from key, so the results are sorted even if there is only one batch, to
+    keep their order the same whatever the batch size.
+
+    @param qs:              The query service
+    @param q:               The HQL query
+    @param ids:             The ids to bind
+    @param service_opts:    The service options to run the query with
+    @param name:            The name of the parameter to bind the ids to
+    @param params:          Parameters for any other placeholders in q
+    @param key:             Function giving the sort key of a result row
+    """
 
-    tags = BlitzSet([])
-    tag1 = conn.getObject('TagAnnotation', 1)
-    tags.add(tag1)
-    tag2 = conn.getObject('TagAnnotation', 1)
-    tag2.setValue("TEST")
-    tags.add(tag2)
+    def run(batch):
+        p = omero.sys.ParametersI(dict(params.map) if params else None)
+        p.addLongs(name, batch)
+        return qs.projection(q, p, service_opts)
 
-    tag1 and tag2 are 2 completely separate objects that to BlitzSet are seen
-    as identical. In this case, the single item in the set would be tag1, not
-    tag2.
+    ids = list(ids)
+    chunks = list(batches(ids, autotag_settings.QUERY_BATCH_SIZE))
 
-    """
+    # Avoid the thread pool when there is nothing to parallelize
+    if len(chunks) <= 1:
+        results = [run(chunks[0])] if chunks else []
+    else:
+        results = list(get_executor().map(run, chunks))
 
-    def __init__(self, s=[]):
+    rows = [row for result in results for row in result]
+    if key is not None:
+        rows.sort(key=key)
+    return rows
 
-        self.__items = dict((self.__item_key(i), i) for i in s)
 
-    def __item_key(self, item):
-        return item.getId()
+def get_tags_on_images(qs, image_ids, service_opts, owner_id=None):
+    """
+    Get the ids of the tags applied to each of the specified images
 
-    def add(self, item):
-        """
-        Add item to set
+    @param owner_id:        Only the tags applied by this user if specified
+    @return:                Dict of image id -> list of tag ids
+    """
 
-        To be consistent with python set, do not overwrite existing items
+    q = """
+        SELECT DISTINCT itlink.parent.id, itlink.child.id
+        FROM ImageAnnotationLink itlink
+        WHERE itlink.child.class=TagAnnotation
+        AND itlink.parent.id IN (:iids)
         """
+    params = None
+    if owner_id is not None:
+        q += "AND itlink.details.owner.id = :uid"
+        params = omero.sys.ParametersI()
+        params.addLong("uid", owner_id)
 
-        if not self.__contains__(item):
-            self.__items[self.__item_key(item)] = item
+    tags_on_images = {}
+    for e in chunked_projection(qs, q, image_ids, service_opts, params=params):
+        tags_on_images.setdefault(e[0].val, []).append(e[1].val)
+    return tags_on_images
 
-    def remove(self, item):
-        """
-        Remove item from set
-        """
 
-        del self.__items[self.__item_key(item)]
+def _tag_catalog_generation_key(group_id):
+    return "omero_webtagging_autotag:tags:%s:generation" % group_id
 
-    def update(self, items):
-        """
-        Add a collection of items to the set
 
-        Unlike add, update overwrites existing items
-        """
+def get_tag_catalog(conn, group_id):
+    """
+    Get the marshalled tags of a group, cached for TAG_CACHE_TTL seconds
 
-        for item in items:
-            self.__items[self.__item_key(item)] = item
+    The tags are cached per user as the marshalled permissions depend on who
+    is asking. Use invalidate_tag_catalog when the tags of a group change.
+    """
 
-    def union(self, other):
-        """
-        Union of this set with specified other set
+    ttl = autotag_settings.TAG_CACHE_TTL
+    if ttl <= 0:
+        return tree.marshal_tags(conn, group_id=group_id)
 
-        To be consistent with python set, self overrides other
-        """
+    generation = cache.get(_tag_catalog_generation_key(group_id), 0)
+    key = "omero_webtagging_autotag:tags:%s:%s:%s" % (
+        group_id,
+        generation,
+        conn.getUserId(),
+    )
+    tags = cache.get(key)
+    if tags is None:
+        tags = tree.marshal_tags(conn, group_id=group_id)
+        cache.set(key, tags, ttl)
+    return tags
 
-        uni = BlitzSet()
-        uni.__items = dict(other.__items, **self.__items)
-        return uni
 
-    def __or__(self, other):
-        """
-        Union using || operator
-        """
+def invalidate_tag_catalog(group_id):
+    """
+    Invalidate the cached tags of a group for every user
+    """
 
-        return self.union(other)
+    key = _tag_catalog_generation_key(group_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Does not exist yet, so start a new generation
+        cache.set(key, 1, None)
 
-    def intersection(self, other):
-        """
-        Intersection of this set with specified other set
 
-        To be consistent with python set, shorter list overrides
-        or the other set if equal length
-        """
+def get_tag_links(conn, pairs):
+    """
+    Get the links belonging to the current user for the specified pairs
 
-        # Determine shorter list for iteration
-        if len(self.__items) < len(other.__items):
-            s1 = self.__items
-            s2 = other.__items
-        else:
-            s1 = other.__items
-            s2 = self.__items
-
-        # Compute the intersection
-        inter = BlitzSet()
-        for k in s1.keys():
-            if k in s2:
-                inter.add(s1[k])
-        return inter
-
-    def __and__(self, other):
-        """
-        Intersection using && operator
-        """
+    The pairs are grouped by tag so that only the requested pairs are
+    queried, not every combination of the images and tags involved
 
-        return self.intersection(other)
+    @param pairs:           Collection of (image id, tag id) pairs
+    @return:                Dict of (image id, tag id) -> link id for the
+                            pairs which are linked
+    """
 
-    def difference(self, other):
-        """
-        Difference of this set and specified other set
+    images_by_tag = {}
+    for image_id, tag_id in set(pairs):
+        images_by_tag.setdefault(tag_id, []).append(image_id)
+
+    q = """
+        SELECT link.id, link.parent.id, link.child.id
+        FROM ImageAnnotationLink link
+        WHERE link.details.owner.id = :uid
+        AND link.child.id = :tid
+        AND link.parent.id IN (:iids)
         """
 
-        inter = BlitzSet()
-        for k in self.__items.keys():
-            if k not in other.__items:
-                inter.add(self.__items[k])
-        return inter
+    qs = timed_query_service(conn, "tag_links")
+    user_id = conn.getUserId()
+
+    def run(job):
+        tag_id, image_ids = job
+        params = omero.sys.ParametersI()
+        params.addLong("uid", user_id)
+        params.addLong("tid", tag_id)
+        params.addLongs("iids", image_ids)
+        return qs.projection(q, params, conn.SERVICE_OPTS)
+
+    jobs = [
+        (tag_id, batch)
+        for tag_id, image_ids in images_by_tag.items()
+        for batch in batches(image_ids, autotag_settings.QUERY_BATCH_SIZE)
+    ]
+    if len(jobs) > 1:
+        results = get_executor().map(run, jobs)
+    else:
+        results = map(run, jobs)
+
+    links = {}
+    for result in results:
+        for e in result:
+            links[(e[1].val, e[2].val)] = e[0].val
+    return links
+
+
+def deleteTagAnnotationsLinks(conn, removals):
+    """
+    Unlinks existing Images from existing Tag annotations
+
+    All the links are deleted in a single request
 
-    def __sub__(self, other):
-        """
-        Difference using - operator
-        """
+    @param removals:        List of (image id, tag id) to unlink
+    @return:                Tuple of the list of (image id, tag id) which
+                            were unlinked and the count of those which did
+                            not exist
+    """
 
-        return self.difference(other)
+    removals = set(removals)
+    links = get_tag_links(conn, removals)
 
-    def symmetric_difference(self, other):
-        """
-        Symmetric difference of this set and specified other set
-        """
+    if links:
+        conn.deleteObjects("ImageAnnotationLink", list(links.values()), wait=True)
 
-        # TODO Performance wise, probably not optimal
-        diff1 = self.difference(other)
-        diff2 = other.difference(self)
-        return diff1.union(diff2)
+    return list(links), len(removals) - len(links)
 
-    def __xor__(self, other):
-        """
-        Symmetric difference using ^ operator
-        """
 
-        return self.symmetric_difference(other)
+def _group_id(conn):
+    group_id = conn.SERVICE_OPTS.getOmeroGroup()
+    if group_id is None or int(group_id) < 0:
+        group_id = conn.getEventContext().groupId
+    return int(group_id)
+
 
-    def __str__(self):
-        return str(list(self.__items.values()))
+def createTagAnnotationsLinks(conn, additions=[], removals=[]):
+    """
+    Links or unlinks existing Images with existing Tag annotations
 
-    def __contains__(self, item):
-        return self.__item_key(item) in self.__items
+    Links which already exist are not created again and the remaining links
+    are saved in batches of LINK_BATCH_SIZE
+
+    @param additions:       List of (image id, tag id) to link
+    @param removals:        List of (image id, tag id) to unlink
+    @return:                Dict of counts of links added, already existing,
+                            failed, removed and missing (i.e. removals
+                            which were not linked)
+    """
+
+    # Drop any duplicates and any links which already exist
+    additions = set(additions)
+    existing = get_tag_links(conn, additions)
+    additions = sorted(additions.difference(existing))
+
+    newLinks = []
+    # Create a list of links to apply
+    for addition in additions:
+        link = omero.model.ImageAnnotationLinkI()
+        link.parent = omero.model.ImageI(addition[0], False)
+        link.child = omero.model.TagAnnotationI(addition[1], False)
+        newLinks.append(link)
 
-    def __iter__(self):
-        return iter(self.__items.values())
+    # Apply the links
+    failed = 0
+    savedLinks = []
+    us = conn.getUpdateService()
+    for batch in batches(newLinks, autotag_settings.LINK_BATCH_SIZE):
+        try:
+            # will fail if any of the links already exist
+            savedLinks.extend(us.saveAndReturnArray(batch, conn.SERVICE_OPTS))
+        except omero.ValidationException:
+            # This will occur if the user has modified the tag landscape
+            # outside of the auto-tagger since the existing links were
+            # queried. Not likely to often happen, but very possible.
+
+            for link in batch:
+                try:
+                    savedLinks.append(us.saveAndReturnObject(link, conn.SERVICE_OPTS))
+                except omero.ValidationException:
+                    failed += 1
+
+    removed, missing = deleteTagAnnotationsLinks(conn, removals)
+
+    if savedLinks or removed:
+        tag_links_changed.send(
+            sender=createTagAnnotationsLinks,
+            group_id=_group_id(conn),
+            user_id=conn.getUserId(),
+            added=[(link.parent.id.val, link.child.id.val) for link in savedLinks],
+            removed=removed,
+        )
 
-    def __len__(self):
-        return len(self.__items)
+    return {
+        "added": len(savedLinks),
+        "existing": len(existing),
+        "failed": failed,
+        "removed": len(removed),
+        "missing": missing,
+    }
@@ -4,49 +4,206 @@ from copy import deepcopy
 import json
 import logging
 from django.http import (
-    HttpResponse,
+    Http404,
     HttpResponseNotAllowed,
     HttpResponseBadRequest,
     JsonResponse,
 )
 from omeroweb.webclient.decorators import login_required
+from omeroweb.decorators import ConnCleaningHttpResponse
 import omero
 from omero.rtypes import rstring, unwrap
 from omeroweb.webclient import tree
-from .utils import createTagAnnotationsLinks
+from . import autotag_settings, jobs
+from .matching import Rule, parse_rules
+from .rules import CONTAINER_IMAGES, diff_images, iter_container_images, iter_images
+from .timing import server_timing, timed_query_service
+from .tokens import build_token_index
+from .updates import UpdateTooLarge, parse_image_ids, parse_update
+from .utils import (
+    createTagAnnotationsLinks,
+    batches,
+    chunked_projection,
+    get_tag_catalog,
+    get_tags_on_images,
+    invalidate_tag_catalog,
+)
 
 logger = logging.getLogger(__name__)
 
+# Default number of changed images in each page of a diff
+DIFF_PAGE_SIZE = 100
+
 
+@server_timing
 @login_required(setGroupContext=True)
 def process_update(request, conn=None, **kwargs):
 
     if not request.POST:
         return HttpResponseNotAllowed("Methods allowed: POST")
 
-    images = json.loads(request.body)
-
-    additions = []
-    removals = []
-
-    for image in images:
-        image_id = image["imageId"]
-
-        additions.extend(
-            [(int(image_id), int(addition),) for addition in image["additions"]]
+    try:
+        additions, removals = parse_update(
+            json.loads(request.body), autotag_settings.MAX_UPDATE_SIZE
         )
-
-        removals.extend(
-            [(int(image_id), int(removal),) for removal in image["removals"]]
+    except UpdateTooLarge as e:
+        return HttpResponseBadRequest(str(e))
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return HttpResponseBadRequest("Invalid update")
+
+    # Large updates can be applied in the background and their progress
+    # polled, so that the request does not time out
+    if request.GET.get("async") in ("true", "1"):
+        job = jobs.submit(
+            conn.getUserId(), _job_connector(request, conn), additions, removals
         )
+        return JsonResponse(job.to_dict(), status=202)
 
     # TODO Interface for createTagAnnotationsLinks is a bit nasty, but go
     # along with it for now
-    createTagAnnotationsLinks(conn, additions, removals)
+    result = createTagAnnotationsLinks(conn, additions, removals)
+
+    return JsonResponse(result)
+
+
+def _job_connector(request, conn):
+    """
+    Get a callable which joins the session of the request on a new connection
+
+    The connection of the request is closed when the request ends, so a
+    background job needs its own
+    """
+
+    connector = request.session.get("connector")
+    group_id = conn.SERVICE_OPTS.getOmeroGroup()
+
+    def connect():
+        job_conn = connector.join_connection("OMERO.web.autotag")
+        if job_conn is None:
+            raise omero.ClientError("Unable to join the session")
+        job_conn.SERVICE_OPTS.setOmeroGroup(group_id)
+        return job_conn
+
+    return connect
+
+
+@server_timing
+@login_required(setGroupContext=True)
+def apply_container_rules(request, conn=None, **kwargs):
+    """
+    Apply auto-tag rules to all the images in a Dataset, Project or Plate
+
+    The body is {"containerType": type, "containerId": id, "rules": rules}
+    where rules are as for matching.parse_rules. The rules are applied in the
+    background and their progress polled as for process_update with async.
+    """
+
+    if request.method != "POST":
+        return HttpResponseNotAllowed("Methods allowed: POST")
+
+    try:
+        body = json.loads(request.body)
+        container_type = body["containerType"]
+        container_id = int(body["containerId"])
+        rules = parse_rules(body["rules"])
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return HttpResponseBadRequest("Invalid rules")
+
+    if container_type not in CONTAINER_IMAGES or not rules:
+        return HttpResponseBadRequest("Invalid rules")
+
+    if conn.getObject(container_type, container_id) is None:
+        raise Http404("No such %s" % container_type)
+
+    job = jobs.submit_rules(
+        conn.getUserId(),
+        _job_connector(request, conn),
+        container_type,
+        container_id,
+        rules,
+    )
+    return JsonResponse(job.to_dict(), status=202)
+
+
+@server_timing
+@login_required(setGroupContext=True)
+def diff_rules(request, conn=None, **kwargs):
+    """
+    Get the links which rules would add to, or remove from, images without
+    changing anything
+
+    The body has the images as {"imageIds": ids}, where any of the ids may
+    be an inclusive [start, end] range and there may be up to
+    MAX_UPDATE_SIZE ids in all, or as
+    {"containerType": type, "containerId": id}, and the rules as
+    {"mapping": {token: tag id}} or {"rules": rules} as for
+    matching.parse_rules. "exact", "offset" and "limit" are optional, see
+    matching.diff_pages.
+    """
+
+    if request.method != "POST":
+        return HttpResponseNotAllowed("Methods allowed: POST")
+
+    try:
+        body = json.loads(request.body)
+        if "mapping" in body:
+            rules = [Rule(t, token=token) for token, t in body["mapping"].items()]
+        else:
+            rules = parse_rules(body["rules"])
+        exact = bool(body.get("exact", False))
+        offset = max(int(body.get("offset", 0)), 0)
+        limit = int(body.get("limit", DIFF_PAGE_SIZE))
+        limit = min(max(limit, 0), autotag_settings.PAGE_SIZE)
+        if "imageIds" in body:
+            pages = iter_images(
+                conn,
+                list(
+                    parse_image_ids(body["imageIds"], autotag_settings.MAX_UPDATE_SIZE)
+                ),
+            )
+        else:
+            container_type = body["containerType"]
+            container_id = int(body["containerId"])
+            if container_type not in CONTAINER_IMAGES:
+                raise ValueError(container_type)
+            pages = None
+    except UpdateTooLarge as e:
+        return HttpResponseBadRequest(str(e))
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return HttpResponseBadRequest("Invalid diff")
+
+    if not rules:
+        return HttpResponseBadRequest("Invalid diff")
+
+    if pages is None:
+        if conn.getObject(container_type, container_id) is None:
+            raise Http404("No such %s" % container_type)
+        pages = iter_container_images(conn, container_type, container_id)
+
+    result = diff_images(conn, pages, rules, exact, offset, limit)
+    result["offset"] = offset
+    result["limit"] = limit
+    if result["summary"]["changedImages"] > offset + limit:
+        result["nextOffset"] = offset + limit
+
+    return JsonResponse(result)
+
+
+@server_timing
+@login_required()
+def process_update_progress(request, job_id, conn=None, **kwargs):
+    """
+    Get the progress of an update submitted with async
+    """
 
-    return HttpResponse("")
+    job = jobs.get_job(job_id, conn.getUserId())
+    if job is None:
+        raise Http404("No such job: %s" % job_id)
 
+    return JsonResponse(job)
 
+
+@server_timing
 @login_required(setGroupContext=True)
 def create_tag(request, conn=None, **kwargs):
     """
@@ -68,10 +225,13 @@ def create_tag(request, conn=None, **kwargs):
 
     tag = conn.getUpdateService().saveAndReturnObject(tag, conn.SERVICE_OPTS)
 
+    # The group's tags have changed
+    invalidate_tag_catalog(tag.details.group.id.val)
+
     params = omero.sys.ParametersI()
     service_opts = deepcopy(conn.SERVICE_OPTS)
 
-    qs = conn.getQueryService()
+    qs = timed_query_service(conn, "created_tag")
 
     q = """
         select new map(tag.id as id,
@@ -114,6 +274,110 @@ def _marshal_image(conn, row, tags_on_images):
     return image
 
 
+def _image_order_key(e):
+    # Order of the images by lower case name then id. The image queries are
+    # sorted by this in chunked_projection, as the ORDER BY of each batch may
+    # collate names differently
+    e = e[0].val
+    return (e["name"].val.lower(), e["id"].val)
+
+
+def _get_ordered_image_ids(qs, image_ids, service_opts):
+    """
+    Get the ids of the specified images, ordered by name and id
+    """
+
+    q = """
+        SELECT new map(image.id AS id,
+               image.name AS name)
+        FROM Image image
+        JOIN image.fileset fileset
+        JOIN fileset.usedFiles filesetentry
+        WHERE index(filesetentry) = 0
+        AND image.id IN (:iids)
+        ORDER BY lower(image.name), image.id
+        """
+
+    return [
+        e[0].val["id"].val
+        for e in chunked_projection(
+            qs, q, image_ids, service_opts, key=_image_order_key
+        )
+    ]
+
+
+def _get_images(conn, qs, image_ids, service_opts):
+    """
+    Get the details and tags of the specified images, ordered by name and id
+    """
+
+    q = """
+        SELECT new map(image.id AS id,
+               image.name AS name,
+               image.details.owner.id AS ownerId,
+               image AS image_details_permissions,
+               image.fileset.id AS filesetId,
+               filesetentry.clientPath AS clientPath)
+        FROM Image image
+        JOIN image.fileset fileset
+        JOIN fileset.usedFiles filesetentry
+        WHERE index(filesetentry) = 0
+        AND image.id IN (:iids)
+        ORDER BY lower(image.name), image.id
+        """
+
+    rows = []
+    for e in chunked_projection(qs, q, image_ids, service_opts, key=_image_order_key):
+        e = unwrap(e)[0]
+        rows.append(
+            [
+                e["id"],
+                e["name"],
+                e["ownerId"],
+                e["image_details_permissions"],
+                e["filesetId"],
+                e["clientPath"],
+            ]
+        )
+
+    if not rows:
+        return []
+
+    # Get the tags that are applied to just these images
+    tags_on_images = get_tags_on_images(qs, [row[0] for row in rows], service_opts)
+
+    return [_marshal_image(conn, row, tags_on_images) for row in rows]
+
+
+def _add_token_index(response, images):
+    index, counts = build_token_index(
+        (image["id"], image["clientPath"]) for image in images
+    )
+    response["tokenIndex"] = index
+    response["tokenCounts"] = counts
+
+
+def _parse_image_detail_request(request, conn):
+    """
+    Get the image ids, token index flag and group from the request
+
+    Returns None for the image ids if there were none
+    """
+
+    image_ids = request.POST.getlist("imageIds[]")
+    image_ids = list(map(int, image_ids)) or None
+
+    # Optionally tokenize the image paths here instead of in the browser
+    token_index = request.POST.get("tokenIndex") in ("true", "1")
+
+    group_id = request.session.get("active_group")
+    if group_id is None:
+        group_id = conn.getEventContext().groupId
+
+    return image_ids, token_index, group_id
+
+
+@server_timing
 @login_required(setGroupContext=True)
 def get_image_detail_and_tags(request, conn=None, **kwargs):
     # According to REST, this should be a GET, but because of the amount of
@@ -121,74 +385,87 @@ def get_image_detail_and_tags(request, conn=None, **kwargs):
     if not request.POST:
         return HttpResponseNotAllowed("Methods allowed: POST")
 
-    image_ids = request.POST.getlist("imageIds[]")
+    image_ids, token_index, group_id = _parse_image_detail_request(request, conn)
 
     if not image_ids:
         return HttpResponseBadRequest("Image IDs required")
 
-    image_ids = list(map(int, image_ids))
-
-    group_id = request.session.get("active_group")
-    if group_id is None:
-        group_id = conn.getEventContext().groupId
-
     # All the tags available to the user
-    tags = tree.marshal_tags(conn, group_id=group_id)
+    tags = get_tag_catalog(conn, group_id)
 
     # Details about the images specified
-    params = omero.sys.ParametersI()
     service_opts = deepcopy(conn.SERVICE_OPTS)
 
     # Set the desired group context
     service_opts.setOmeroGroup(group_id)
 
-    params.addLongs("iids", image_ids)
+    qs = timed_query_service(conn, "image_details")
 
-    qs = conn.getQueryService()
+    images = _get_images(conn, qs, image_ids, service_opts)
 
-    # Get the tags that are applied to individual images
-    q = """
-        SELECT DISTINCT itlink.parent.id, itlink.child.id
-        FROM ImageAnnotationLink itlink
-        WHERE itlink.child.class=TagAnnotation
-        AND itlink.parent.id IN (:iids)
-        """
+    # Get the users from this group for reference
+    users = tree.marshal_experimenters(conn, group_id=group_id, page=None)
 
-    tags_on_images = {}
-    for e in qs.projection(q, params, service_opts):
-        tags_on_images.setdefault(unwrap(e[0]), []).append(unwrap(e[1]))
+    response = {"tags": tags, "images": images, "users": users}
 
-    # Get the images' details
-    q = """
-        SELECT new map(image.id AS id,
-               image.name AS name,
-               image.details.owner.id AS ownerId,
-               image AS image_details_permissions,
-               image.fileset.id AS filesetId,
-               filesetentry.clientPath AS clientPath)
-        FROM Image image
-        JOIN image.fileset fileset
-        JOIN fileset.usedFiles filesetentry
-        WHERE index(filesetentry) = 0
-        AND image.id IN (:iids)
-        ORDER BY lower(image.name), image.id
-        """
+    if token_index:
+        _add_token_index(response, images)
 
-    images = []
+    return JsonResponse(response)
 
-    for e in qs.projection(q, params, service_opts):
-        e = unwrap(e)[0]
-        d = [
-            e["id"],
-            e["name"],
-            e["ownerId"],
-            e["image_details_permissions"],
-            e["filesetId"],
-            e["clientPath"],
-        ]
-        images.append(_marshal_image(conn, d, tags_on_images))
 
-    # Get the users from this group for reference
+def _stream_image_detail_and_tags(conn, image_ids, token_index, group_id):
+    """
+    Generate the NDJSON lines for stream_image_detail_and_tags
+
+    The first line has the tags and users, each subsequent line has a page
+    of images (and the token index for that page if requested)
+    """
+
+    tags = get_tag_catalog(conn, group_id)
     users = tree.marshal_experimenters(conn, group_id=group_id, page=None)
+    yield json.dumps({"tags": tags, "users": users}) + "\n"
+
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+    service_opts.setOmeroGroup(group_id)
+
+    qs = timed_query_service(conn, "image_details")
+
+    # Order the images up front so that each page only has to bind its own
+    # ids in the detail query
+    image_ids = _get_ordered_image_ids(qs, image_ids, service_opts)
+
+    for page_ids in batches(image_ids, autotag_settings.PAGE_SIZE):
+        images = _get_images(conn, qs, page_ids, service_opts)
+
+        page = {"images": images}
+        if token_index:
+            _add_token_index(page, images)
+        yield json.dumps(page) + "\n"
+
+
+@server_timing
+@login_required(setGroupContext=True, doConnectionCleanup=False)
+def stream_image_detail_and_tags(request, conn=None, **kwargs):
+    """
+    Streaming variant of get_image_detail_and_tags for large selections
+
+    Images are returned as newline delimited JSON, one page per line, so that
+    they can be displayed before the whole selection has been loaded
+    """
+
+    if not request.POST:
+        return HttpResponseNotAllowed("Methods allowed: POST")
+
+    image_ids, token_index, group_id = _parse_image_detail_request(request, conn)
+
+    if not image_ids:
+        return HttpResponseBadRequest("Image IDs required")
 
-    return JsonResponse({"tags": tags, "images": images, "users": users})
+    rsp = ConnCleaningHttpResponse(
+        _stream_image_detail_and_tags(conn, image_ids, token_index, group_id),
+        content_type="application/x-ndjson",
+    )
+    # The connection is needed until the last page has been streamed
+    rsp.conn = conn
+    return rsp
@@ -32,6 +32,8 @@ export default class AutoTagForm extends React.Component {
 
     // Abort capable AJAX variables
     this.loadRequest = undefined;
+    // What the current request has loaded so far
+    this.load = undefined;
 
     // Prebind this to callback methods
     this.onSubmit = this.onSubmit.bind(this);
@@ -143,177 +145,255 @@ export default class AutoTagForm extends React.Component {
       return;
     }
 
+    // Everything loaded so far, built up as each line of the response arrives
+    let load = {
+      // Length of the response text already processed
+      received: 0,
+      // When the images were last shown
+      shown: 0,
+      // All users map, id -> User
+      users: new Map(),
+      // All tags map, id -> Tag
+      tags: new Map(),
+      // Tag values map, value -> [ids]
+      tagValuesMap: new Map(),
+      // The possible mapping of tokens to tags
+      // The active mapping
+      // Counts of token use
+      tokenMap: new Map(),
+      images: new Set(),
+      // Images by id for resolving the server-side token index
+      imagesById: new Map(),
+      // Set of all tags which are used in at least one image, irrespective of
+      // whether there is a token mapping using it or possible using it
+      allAppliedTags: new Set()
+    };
+    this.load = load;
+
+    // The images are streamed as newline delimited JSON, the first line
+    // having the tags and users and each other line a page of images, so
+    // that they can be shown before they have all been loaded
     this.loadRequest = $.ajax({
       url: this.props.url,
       type: "POST",
-      data: { imageIds: imageIds },
-      dataType: 'json',
-      cache: false
+      data: { imageIds: imageIds, tokenIndex: true },
+      dataType: 'text',
+      cache: false,
+      xhrFields: {
+        onprogress: e => {
+          if (this.load === load) {
+            this.receive(load, e.target.responseText, false);
+          }
+        }
+      }
     });
 
-    this.loadRequest.done(jsonData => {
+    this.loadRequest.done(text => {
+      if (this.load === load) {
+        this.receive(load, text, true);
+      }
+    });
 
-        // All users map, id -> User
-        let users = new Map();
+    //   error: function(xhr, status, err) {
+    //     console.error(this.props.url, status, err.toString());
+    //   }.bind(this)
+    // });
+  }
 
-        // All tags map, id -> Tag
-        let tags = new Map();
+  receive(load, text, complete) {
 
-        // Tag values map, value -> [ids]
-        let tagValuesMap = new Map();
+    // Process the lines which have been received in full
+    let end = text.lastIndexOf('\n') + 1;
+    if (end > load.received) {
+      text.substring(load.received, end).split('\n').forEach(line => {
+        if (line.length > 0) {
+          this.receiveLine(load, JSON.parse(line));
+        }
+      });
+      load.received = end;
+    }
 
-        // Process users
-        jsonData.users.forEach(jsonUser => {
-          let user = new User(
-            jsonUser.id,
-            jsonUser.omeName,
-            jsonUser.firstName,
-            jsonUser.lastName,
-            jsonUser.email
-          );
-          users.set(user.id, user);
-        });
+    // Show the images once they have all loaded, and at most every second
+    // until then, as it is done for all of them each time
+    if (complete || (load.images.size > 0 && Date.now() - load.shown > 1000)) {
+      this.showImages(load);
+      load.shown = Date.now();
+    }
 
-        // Process tags
-        jsonData.tags.forEach(jsonTag => {
+  }
 
-          // Resolve the owner ID to a user
-          let tagOwner = users.get(jsonTag.ownerId);
+  receiveLine(load, jsonData) {
 
-          // Add the mapping from id to Tag
-          let tag = new Tag(
-            jsonTag.id,
-            jsonTag.value,
-            jsonTag.description,
-            tagOwner,
-            jsonTag.permsCss,
-            jsonTag.set
-          );
-          tags.set(tag.id, tag);
-
-          // Create an entry if necessary and add this tag as a potential
-          // match for the tag's value
-          if (!tagValuesMap.has(tag.value)) {
-            tagValuesMap.set(tag.value, new Set([tag]));
-          } else {
-            tagValuesMap.get(tag.value).add(tag);
-          }
+    if (jsonData.tags === undefined) {
+      this.receiveImages(load, jsonData);
+      return;
+    }
 
-        });
+    // Process users
+    jsonData.users.forEach(jsonUser => {
+      let user = new User(
+        jsonUser.id,
+        jsonUser.omeName,
+        jsonUser.firstName,
+        jsonUser.lastName,
+        jsonUser.email
+      );
+      load.users.set(user.id, user);
+    });
 
-        // Set of all tags which are used in at least one image, irrespective of
-        // whether there is a token mapping using it or possible using it
-        let allAppliedTags = new Set();
+    // Process tags
+    jsonData.tags.forEach(jsonTag => {
+
+      // Resolve the owner ID to a user
+      let tagOwner = load.users.get(jsonTag.ownerId);
+
+      // Add the mapping from id to Tag
+      let tag = new Tag(
+        jsonTag.id,
+        jsonTag.value,
+        jsonTag.description,
+        tagOwner,
+        jsonTag.permsCss,
+        jsonTag.set
+      );
+      load.tags.set(tag.id, tag);
+
+      // Create an entry if necessary and add this tag as a potential
+      // match for the tag's value
+      if (!load.tagValuesMap.has(tag.value)) {
+        load.tagValuesMap.set(tag.value, new Set([tag]));
+      } else {
+        load.tagValuesMap.get(tag.value).add(tag);
+      }
 
-        // The possible mapping of tokens to tags
-        // The active mapping
-        // Counts of token use
-        let tokenMap = new Map();
+    });
 
-        let images = new Set();
+  }
 
-        // Process the images
-        jsonData.images.forEach(jsonImage => {
+  receiveImages(load, jsonPage) {
 
-          // Resolve the owner ID to a user
-          let imageOwner = users.get(jsonImage.ownerId);
+    // Process the images
+    jsonPage.images.forEach(jsonImage => {
 
-          // Get the tags that correspond to these tagIds
-          let imageTags = new Set(
-            jsonImage.tags.map(
-              jsonTagId => tags.get(jsonTagId)
-            )
-          );
+      // Resolve the owner ID to a user
+      let imageOwner = load.users.get(jsonImage.ownerId);
 
-          // Add the image to the set
-          let image = new Image(
-            jsonImage.id,
-            jsonImage.name,
-            imageOwner,
-            jsonImage.permsCss,
-            jsonImage.clientPath,
-            imageTags
-          );
-          images.add(image);
+      // Get the tags that correspond to these tagIds
+      let imageTags = new Set(
+        jsonImage.tags.map(
+          jsonTagId => load.tags.get(jsonTagId)
+        )
+      );
+
+      // Add the image to the set
+      let image = new Image(
+        jsonImage.id,
+        jsonImage.name,
+        imageOwner,
+        jsonImage.permsCss,
+        jsonImage.clientPath,
+        imageTags
+      );
+      load.images.add(image);
+      load.imagesById.set(image.id, image);
+
+      // Find the tokens on each image, updating the tokenMap in place,
+      // unless the server has already done this
+      if (jsonPage.tokenIndex === undefined) {
+        image.tokens = this.tokensInName(image, load.tagValuesMap, load.tokenMap);
+      }
+
+      // Add any tags found on this image to this definitive set of used
+      // tags
+      load.allAppliedTags = union(load.allAppliedTags, image.tags);
 
+    });
 
-          // Find the tokens on each image, updating the tokenMap in place
-          image.tokens = this.tokensInName(image, tagValuesMap, tokenMap);
+    // Add to the tokenMap from the server-side token index of the page
+    if (jsonPage.tokenIndex !== undefined) {
+      Object.keys(jsonPage.tokenIndex).forEach(value => {
+        let token = load.tokenMap.get(value);
+        if (token === undefined) {
+          token = this.addOrUpdateToken(undefined, load.tagValuesMap, load.tokenMap, value);
+          token.count = 0;
+        }
+        token.count += jsonPage.tokenCounts[value];
+        jsonPage.tokenIndex[value].forEach(imageId =>
+          load.imagesById.get(imageId).tokens.add(token)
+        );
+      });
+    }
 
-          // Check any tokens that exist on this image by default
-          image.checkedTokens = new Set(image.tokens);
+  }
 
-          // Add any tags found on this image to this definitive set of used
-          // tags
-          allAppliedTags = union(allAppliedTags, image.tags);
+  showImages(load) {
 
-        });
+    let images = load.images;
+    let tokenMap = load.tokenMap;
 
-        // Process the images again now that the token->tag map is complete as
-        // the image may have tags applied for token->tag mappings where it
-        // does not have the token. These should also be marked as checked
-        // automatically
-
-        // Get the reverse mapping of the tags to tokens. This is only possible
-        // because there should be a 1:1 mapping between tokens and tags
-        let activeTagTokenMap = new Map([...tokenMap].filter(
-          kv => kv[1].isActive()
-        ).map(
-          kv => [kv[1].activeTag, kv[1]]
-        ));
-
-        // Also get the activeTagTokenMap as a Set for set operations
-        let activeTagSet = new Set(activeTagTokenMap.keys());
-
-        // Find the tags which are mapped in some way
-        let mappedTags = new Set();
-        tokenMap.forEach(token => {
-          mappedTags = union(mappedTags, token.possible);
-        });
+    // Check any tokens that exist on each image by default
+    images.forEach(image => {
+      image.checkedTokens = new Set(image.tokens);
+    });
+
+    // Process the images again now that the token->tag map is complete as
+    // the image may have tags applied for token->tag mappings where it
+    // does not have the token. These should also be marked as checked
+    // automatically
 
-        // Find the tags that are not applied in any way
-        let unmappedTags = difference(allAppliedTags, mappedTags);
+    // Get the reverse mapping of the tags to tokens. This is only possible
+    // because there should be a 1:1 mapping between tokens and tags
+    let activeTagTokenMap = new Map([...tokenMap].filter(
+      kv => kv[1].isActive()
+    ).map(
+      kv => [kv[1].activeTag, kv[1]]
+    ));
 
+    // Also get the activeTagTokenMap as a Set for set operations
+    let activeTagSet = new Set(activeTagTokenMap.keys());
 
-        // Check tokens due to applied tags for auto-mappings and
-        // Check tags due to applied tags where there are no mappings
-        images.forEach(image => {
+    // Find the tags which are mapped in some way
+    let mappedTags = new Set();
+    tokenMap.forEach(token => {
+      mappedTags = union(mappedTags, token.possible);
+    });
 
-          // Get the set of tags on this image that are currently mapped
-          let appliedImageTags = intersection(activeTagSet, image.tags);
+    // Find the tags that are not applied in any way
+    let unmappedTags = difference(load.allAppliedTags, mappedTags);
 
-          // Lookup the tokens which those tags are mapped to and mark them
-          // as checked
-          appliedImageTags.forEach(tag => {
-            let token = activeTagTokenMap.get(tag);
-            image.checkToken(token);
-          });
 
-          // Get the set of tags that are on the image, but not involved in
-          // any mapping. Apply this to checkedTags
-          image.checkedTags = intersection(image.tags, unmappedTags);
+    // Check tokens due to applied tags for auto-mappings and
+    // Check tags due to applied tags where there are no mappings
+    images.forEach(image => {
 
-        });
+      // Get the set of tags on this image that are currently mapped
+      let appliedImageTags = intersection(activeTagSet, image.tags);
 
-        // Set the state
-        // Special case requiredTokenCardinality for when there is only one image
-        this.setState({
-          images: images,
-          users: users,
-          tags: tags,
-          tokenMap: tokenMap,
-          unmappedTags: unmappedTags,
-          requiredTokenCardinality: images.size === 1 ? 1 : 2,
-          maxTokenCardinality: images.size
-        });
+      // Lookup the tokens which those tags are mapped to and mark them
+      // as checked
+      appliedImageTags.forEach(tag => {
+        let token = activeTagTokenMap.get(tag);
+        image.checkToken(token);
+      });
 
-      }
-    );
+      // Get the set of tags that are on the image, but not involved in
+      // any mapping. Apply this to checkedTags
+      image.checkedTags = intersection(image.tags, unmappedTags);
+
+    });
+
+    // Set the state, with copies of the collections still being loaded
+    // Special case requiredTokenCardinality for when there is only one image
+    this.setState({
+      images: new Set(images),
+      users: load.users,
+      tags: load.tags,
+      tokenMap: new Map(tokenMap),
+      unmappedTags: unmappedTags,
+      requiredTokenCardinality: images.size === 1 ? 1 : 2,
+      maxTokenCardinality: images.size
+    });
 
-    //   error: function(xhr, status, err) {
-    //     console.error(this.props.url, status, err.toString());
-    //   }.bind(this)
-    // });
   }
 
   componentDidMount() {
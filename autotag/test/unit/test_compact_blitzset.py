@@ -0,0 +1,171 @@
+"""
+Compare CompactBlitzSet with a reference model of BlitzSet's semantics
+"""
+
+from builtins import object, range
+import random
+
+import pytest
+
+from omero_webtagging_autotag.blitzset import CompactBlitzSet
+
+
+class Item(object):
+    def __init__(self, id, label=None):
+        self.id = id
+        self.label = label
+
+    def getId(self):
+        return self.id
+
+    def __repr__(self):
+        return "Item(%s, %r)" % (self.id, self.label)
+
+
+class Model(object):
+    """
+    Dict of id -> item with the rules of BlitzSet for which item is kept
+    """
+
+    def __init__(self, s=[]):
+        self.items = dict((i.getId(), i) for i in s)
+
+    @classmethod
+    def of(cls, items):
+        model = cls()
+        model.items = items
+        return model
+
+    def add(self, item):
+        self.items.setdefault(item.getId(), item)
+
+    def remove(self, item):
+        del self.items[item.getId()]
+
+    def update(self, items):
+        for item in items:
+            self.items[item.getId()] = item
+
+    def union(self, other):
+        items = dict(other.items)
+        items.update(self.items)
+        return Model.of(items)
+
+    def intersection(self, other):
+        if len(self.items) < len(other.items):
+            s1, s2 = self.items, other.items
+        else:
+            s1, s2 = other.items, self.items
+        return Model.of(dict((k, v) for k, v in s1.items() if k in s2))
+
+    def difference(self, other):
+        return Model.of(
+            dict((k, v) for k, v in self.items.items() if k not in other.items)
+        )
+
+    def symmetric_difference(self, other):
+        return self.difference(other).union(other.difference(self))
+
+
+def contents(s):
+    # The items themselves, not just their ids, must be the same
+    return sorted((item.getId(), id(item)) for item in s)
+
+
+def check(compact, model):
+    assert contents(compact) == contents(model.items.values())
+    assert len(compact) == len(model.items)
+
+
+def random_items(rand, label, size, ids=50):
+    return [Item(rand.randrange(ids), (label, n)) for n in range(size)]
+
+
+OPERATIONS = ("union", "intersection", "difference", "symmetric_difference")
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_against_model(seed):
+    rand = random.Random(seed)
+    sets = []
+    for n in range(4):
+        items = random_items(rand, n, rand.randrange(40))
+        sets.append((CompactBlitzSet(items), Model(items)))
+    for c, m in sets:
+        check(c, m)
+
+    for step in range(100):
+        c, m = rand.choice(sets)
+        action = rand.randrange(4)
+        if action == 0:
+            item = Item(rand.randrange(50), ("add", step))
+            c.add(item)
+            m.add(item)
+        elif action == 1:
+            item = Item(rand.randrange(50))
+            if item.getId() in m.items:
+                c.remove(item)
+                m.remove(item)
+            else:
+                with pytest.raises(KeyError):
+                    c.remove(item)
+        elif action == 2:
+            items = random_items(rand, ("update", step), rand.randrange(10))
+            c.update(items)
+            m.update(items)
+        else:
+            other_c, other_m = rand.choice(sets)
+            operation = rand.choice(OPERATIONS)
+            c = getattr(c, operation)(other_c)
+            m = getattr(m, operation)(other_m)
+            # Results are operated on, and modified, in later steps
+            sets.append((c, m))
+        check(c, m)
+        probe = Item(rand.randrange(50))
+        assert (probe in c) == (probe.getId() in m.items)
+
+
+def test_operators():
+    rand = random.Random(0)
+    a = random_items(rand, "a", 30)
+    b = random_items(rand, "b", 30)
+    ca, cb = CompactBlitzSet(a), CompactBlitzSet(b)
+    ma, mb = Model(a), Model(b)
+    check(ca | cb, ma.union(mb))
+    check(ca & cb, ma.intersection(mb))
+    check(ca - cb, ma.difference(mb))
+    check(ca ^ cb, ma.symmetric_difference(mb))
+
+
+def test_difference_then_union_keeps_other_items():
+    x = CompactBlitzSet([Item(i, "x") for i in range(10)])
+    y = CompactBlitzSet([Item(i, "y") for i in range(10)])
+    result = (x - CompactBlitzSet([Item(1, "one")])) | y
+    assert [i.label for i in result if i.getId() == 1] == ["y"]
+
+
+def test_removed_item_is_not_kept():
+    s = CompactBlitzSet([Item(i, "s") for i in range(3)])
+    t = s | CompactBlitzSet([])
+    t.remove(Item(1))
+    y = CompactBlitzSet([Item(1, "y")])
+    assert [i.label for i in t ^ y if i.getId() == 1] == ["y"]
+    assert Item(1) in s
+
+
+def test_pending_adds():
+    s = CompactBlitzSet([Item(i, "s") for i in range(0, 10, 2)])
+    for i in range(10):
+        s.add(Item(i, "add"))
+    s.add(Item(1, "again"))
+    assert Item(3) in s and Item(4) in s and Item(10) not in s
+    t = s.difference(CompactBlitzSet([Item(5)]))
+    assert [(i.getId(), i.label) for i in t][:4] == [
+        (0, "s"),
+        (1, "add"),
+        (2, "s"),
+        (3, "add"),
+    ]
+    s.add(Item(11, "add"))
+    s.remove(Item(11))
+    assert len(s) == 10
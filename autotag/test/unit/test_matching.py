@@ -0,0 +1,137 @@
+"""
+Matching rules to images and previewing the changes they would make
+"""
+
+import pytest
+
+from omero_webtagging_autotag.matching import (
+    Rule,
+    diff_pages,
+    match_images,
+    parse_rules,
+)
+from omero_webtagging_autotag.tokens import build_token_index, tokenize_path
+
+
+def image(image_id, path, name=None):
+    return {"id": image_id, "clientPath": path, "name": name or path}
+
+
+def test_tokenize_path():
+    assert tokenize_path("/data/run_1/DAPI.tif") == ["data", "run", "1", "DAPI", "tif"]
+    assert tokenize_path("a\\b  c") == ["a", "b", "c"]
+    assert tokenize_path("") == []
+    assert tokenize_path(None) == []
+
+
+def test_build_token_index():
+    index, counts = build_token_index([(1, "a/b/a"), (2, "b"), (3, None)])
+    assert index == {"a": [1], "b": [1, 2]}
+    assert counts == {"a": 2, "b": 2}
+
+
+def test_parse_rules():
+    rules = parse_rules(
+        [
+            {"tagId": "1", "token": "DAPI"},
+            {"tagId": 2, "regex": "^plate_\\d+", "field": "name"},
+        ]
+    )
+    assert [(r.tag_id, r.token, r.field) for r in rules] == [
+        (1, "DAPI", "clientPath"),
+        (2, None, "name"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        {"token": "a"},
+        {"tagId": 1},
+        {"tagId": 1, "token": "a", "regex": "a"},
+        {"tagId": 1, "token": "a", "field": "description"},
+        {"tagId": 1, "regex": "("},
+        {"tagId": "x", "token": "a"},
+        "a",
+    ],
+)
+def test_parse_rules_invalid(rule):
+    with pytest.raises(ValueError):
+        parse_rules([rule])
+
+
+def test_match_images():
+    rules = [
+        Rule(1, token="DAPI"),
+        Rule(2, regex="^plate_\\d+", field="name"),
+        Rule(3, token="GFP"),
+        Rule(3, token="FITC"),
+    ]
+    images = [
+        image(1, "/a/DAPI_1.tif", "plate_1"),
+        image(2, "/a/DAPIX_FITC.tif", "my plate_1"),
+        image(3, "/a/b.tif"),
+        image(4, None, None),
+    ]
+    matched = match_images(images, rules)
+    assert [(i["id"], tag_ids) for i, tag_ids in matched] == [
+        (1, [1, 2]),
+        (2, [3]),
+        (3, []),
+        (4, []),
+    ]
+
+
+def diff(tags, owned_tags, exact=False, offset=0, limit=100):
+    pages = [
+        [image(1, "/a/DAPI.tif"), image(2, "/a/GFP.tif")],
+        [image(3, "/a/DAPI_GFP.tif"), image(4, "/a/other.tif")],
+    ]
+    rules = [Rule(10, token="DAPI"), Rule(11, token="GFP")]
+
+    def get_tags(image_ids, owned):
+        on_images = owned_tags if owned else tags
+        return dict((i, on_images[i]) for i in image_ids if i in on_images)
+
+    return diff_pages(pages, rules, get_tags, exact, offset, limit)
+
+
+def test_diff_pages_additions():
+    result = diff({1: [10], 3: [11, 12], 4: [10]}, {})
+    assert result["summary"] == {
+        "images": 4,
+        "changedImages": 2,
+        "additions": 2,
+        "removals": 0,
+        "tags": {
+            10: {"additions": 1, "removals": 0},
+            11: {"additions": 1, "removals": 0},
+        },
+    }
+    assert result["diff"] == [
+        {"imageId": 2, "name": "/a/GFP.tif", "additions": [11], "removals": []},
+        {"imageId": 3, "name": "/a/DAPI_GFP.tif", "additions": [10], "removals": []},
+    ]
+
+
+def test_diff_pages_exact_only_removes_owned():
+    # Image 4 has tag 10 linked by the current user and tag 11 by another, so
+    # only tag 10 could be removed. Tags without rules are never removed.
+    tags = {1: [10], 3: [10, 11], 4: [10, 11, 12]}
+    owned = {1: [10], 4: [10, 12]}
+    result = diff(tags, owned, exact=True)
+    assert result["summary"]["changedImages"] == 2
+    assert result["summary"]["removals"] == 1
+    assert result["summary"]["tags"][10] == {"additions": 0, "removals": 1}
+    assert result["diff"][-1] == {
+        "imageId": 4,
+        "name": "/a/other.tif",
+        "additions": [],
+        "removals": [10],
+    }
+
+
+def test_diff_pages_paging():
+    result = diff({}, {}, offset=1, limit=1)
+    assert result["summary"]["changedImages"] == 3
+    assert [d["imageId"] for d in result["diff"]] == [2]
@@ -0,0 +1,74 @@
+"""
+Parsing of the updates posted to process_update
+"""
+
+import pytest
+
+from omero_webtagging_autotag.updates import (
+    UpdateTooLarge,
+    parse_image_ids,
+    parse_update,
+)
+
+
+def test_parse_image_ids_expands_ranges():
+    assert list(parse_image_ids([1, [3, 5], "7", [9, 9]], 10)) == [1, 3, 4, 5, 7, 9]
+
+
+def test_parse_image_ids_rejects_invalid_ranges():
+    with pytest.raises(ValueError):
+        list(parse_image_ids([[5, 1]], 10))
+    with pytest.raises(ValueError):
+        list(parse_image_ids([[1, 2, 3]], 10))
+
+
+def test_parse_image_ids_limit():
+    assert len(list(parse_image_ids([[1, 10]], 10))) == 10
+    with pytest.raises(UpdateTooLarge):
+        list(parse_image_ids([[1, 10], 11], 10))
+
+
+def test_parse_image_ids_limit_before_expanding():
+    ids = parse_image_ids([[1, 10**12]], 10)
+    with pytest.raises(UpdateTooLarge):
+        next(ids)
+
+
+def test_parse_update_tag_centric():
+    additions, removals = parse_update(
+        {"additions": {"1": [[1, 3], 5]}, "removals": {"2": [4]}}, 10
+    )
+    assert additions == [(1, 1), (2, 1), (3, 1), (5, 1)]
+    assert removals == [(4, 2)]
+
+
+def test_parse_update_image_centric():
+    additions, removals = parse_update(
+        [
+            {"imageId": 2, "additions": [1, "3"], "removals": []},
+            {"imageId": "1", "additions": [1], "removals": [2]},
+        ],
+        10,
+    )
+    assert additions == [(1, 1), (2, 1), (2, 3)]
+    assert removals == [(1, 2)]
+
+
+def test_parse_update_drops_conflicts():
+    additions, removals = parse_update(
+        {"additions": {"1": [1, 2]}, "removals": {"1": [2, 3]}}, 10
+    )
+    assert additions == [(1, 1)]
+    assert removals == [(3, 1)]
+
+
+def test_parse_update_limits_tag_centric_updates():
+    with pytest.raises(UpdateTooLarge) as e:
+        parse_update({"additions": {"1": [[1, 6]], "2": [[1, 5]]}}, 10)
+    assert str(e.value) == "Too many image ids, the maximum is 10"
+
+
+def test_parse_update_does_not_limit_image_centric_updates():
+    update = [{"imageId": i, "additions": [1], "removals": []} for i in range(20)]
+    additions, removals = parse_update(update, 10)
+    assert len(additions) == 20
@@ -0,0 +1,524 @@
+"""
+Stand-in for an OMERO.web connection backed by a SyntheticGroup
+
+Only the queries made by the autotag and tagsearch apps are understood. Any
+other query raises UnknownQuery with the HQL, so that a handler can be added
+for it here when the apps start making it.
+"""
+
+from builtins import object
+import re
+import threading
+import time
+import omero
+from omero.gateway import DatasetWrapper, ExperimenterWrapper, ServiceOptsDict
+from omero.rtypes import rbool, rlong, rmap, rstring, rtime, unwrap
+
+# Permissions of everything in the synthetic group, as projected by the server
+# for "obj as obj_details_permissions"
+PERMISSIONS = {
+    "perm": "rwra--",
+    "canAnnotate": True,
+    "canDelete": True,
+    "canEdit": True,
+    "canLink": True,
+    "canChgrp": True,
+    "canChown": False,
+}
+
+# Time everything in the synthetic group was created, in milliseconds
+CREATED = 1500000000000
+
+
+class UnknownQuery(Exception):
+    pass
+
+
+def _permissions():
+    return rmap(
+        dict(
+            (k, rstring(v) if isinstance(v, str) else rbool(v))
+            for k, v in PERMISSIONS.items()
+        )
+    )
+
+
+def _page(rows, params):
+    page = getattr(params, "theFilter", None)
+    if page is None:
+        return rows
+    offset = unwrap(page.offset) or 0
+    limit = unwrap(page.limit)
+    return rows[offset : offset + limit] if limit is not None else rows[offset:]
+
+
+class EventContext(object):
+    def __init__(self, group):
+        self.userId = group.user_id
+        self.userName = "user-%s" % group.user_id
+        self.groupId = group.group_id
+        self.groupName = group.group_name
+        self.memberOfGroups = [group.group_id]
+        self.leaderOfGroups = []
+        self.isAdmin = False
+        self.sessionUuid = "benchmark"
+
+
+class FakeQueryService(object):
+    """
+    Query service evaluating the queries of the apps against a SyntheticGroup
+
+    Counts the queries run and the rows returned
+    """
+
+    def __init__(self, group, latency=0):
+        self.group = group
+        self.latency = latency
+        self.queries = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._handlers = [
+            (re.compile(p, re.IGNORECASE), h)
+            for p, h in (
+                (r"from TagAnnotation tag where tag\.id = :tid", self._created_tag),
+                (
+                    r"select distinct itlink\.parent\.id, itlink\.child\.id "
+                    r"from ImageAnnotationLink",
+                    self._tags_on_images,
+                ),
+                (
+                    r"select new map\(image\.id as id, image\.name as name\) "
+                    r"from Image",
+                    self._ordered_images,
+                ),
+                (
+                    r"select new map\(image\.id as id, image\.name as name, "
+                    r"image\.details\.owner\.id",
+                    self._images,
+                ),
+                (
+                    r"select new map\(image\.id as id, image\.name as name, "
+                    r"filesetentry\.clientPath as clientPath\) from Image",
+                    self._rule_images,
+                ),
+                (
+                    r"from ImageAnnotationLink link "
+                    r"where link\.details\.owner\.id = :uid",
+                    self._tag_links,
+                ),
+                (r"select new map\(obj\.id as id, .* from (\w+) obj ", self._preview),
+                (
+                    r"from (\w+)AnnotationLink link where link\.parent\.id in "
+                    r"\(select sublink\.parent\.id",
+                    self._remaining_of_matches,
+                ),
+                (
+                    r"select link\.parent\.id from (\w+)AnnotationLink link "
+                    r"where link\.child\.id in \(:oids\) group by link\.parent\.id",
+                    self._match_all,
+                ),
+                (
+                    r"select link\.child\.id, count\(distinct link\.parent\.id\) "
+                    r"from (\w+)AnnotationLink link where link\.parent\.id in",
+                    self._remaining,
+                ),
+                (
+                    r"select link\.child\.id, count\(link\.id\) "
+                    r"from (\w+)AnnotationLink link",
+                    self._tag_counts,
+                ),
+                (
+                    r"select distinct link\.parent\.id from (\w+)AnnotationLink "
+                    r"link where link\.child\.id in \(:tids\)",
+                    self._match_any,
+                ),
+                (
+                    r"select link\.id, link\.parent\.id, link\.child\.id "
+                    r"from (\w+)AnnotationLink link where link\.child\.class",
+                    self._all_links,
+                ),
+                (r"select tag\.id, tag\.textValue from TagAnnotation tag", self._tags),
+                (r"select distinct g from ExperimenterGroup g", self._groups),
+            )
+        ]
+
+    def _run(self, hql, params):
+        hql = " ".join(hql.split())
+        for pattern, handler in self._handlers:
+            match = pattern.search(hql)
+            if match:
+                break
+        else:
+            raise UnknownQuery(hql)
+
+        values = unwrap(params.map) if params is not None and params.map else {}
+        if self.latency:
+            time.sleep(self.latency)
+        rows = handler(match, values, hql)
+        rows = _page(rows, params)
+        with self._lock:
+            self.queries += 1
+            self.rows += len(rows)
+        return rows
+
+    def projection(self, hql, params, ctx=None):
+        return self._run(hql, params)
+
+    def findAllByQuery(self, hql, params, ctx=None):
+        return self._run(hql, params)
+
+    # Handlers, each returning the rows of a query
+
+    def _created_tag(self, match, values, hql):
+        tag_id = values["tid"]
+        value, owner_id = self.group.tags[tag_id]
+        return [
+            [
+                rmap(
+                    {
+                        "id": rlong(tag_id),
+                        "textValue": rstring(value),
+                        "description": None,
+                        "ownerId": rlong(owner_id),
+                        "tag_details_permissions": _permissions(),
+                        "ns": None,
+                        "childCount": rlong(0),
+                    }
+                )
+            ]
+        ]
+
+    def _tags_on_images(self, match, values, hql):
+        by_parent = self.group.by_parent["Image"]
+        links = self.group.links["Image"]
+        return [
+            [rlong(image_id), rlong(tag_id)]
+            for image_id in values["iids"]
+            for tag_id in by_parent.get(image_id, ())
+            if "uid" not in values or links[(image_id, tag_id)][1] == values["uid"]
+        ]
+
+    def _existing_images(self, values):
+        images = self.group.images
+        return sorted(
+            (i for i in values["iids"] if i in images),
+            key=lambda i: (images[i][0].lower(), i),
+        )
+
+    def _ordered_images(self, match, values, hql):
+        images = self.group.images
+        return [
+            [rmap({"id": rlong(i), "name": rstring(images[i][0])})]
+            for i in self._existing_images(values)
+        ]
+
+    def _images(self, match, values, hql):
+        images = self.group.images
+        rows = []
+        for i in self._existing_images(values):
+            name, path, fileset_id, owner_id = images[i]
+            rows.append(
+                [
+                    rmap(
+                        {
+                            "id": rlong(i),
+                            "name": rstring(name),
+                            "ownerId": rlong(owner_id),
+                            "image_details_permissions": _permissions(),
+                            "filesetId": rlong(fileset_id),
+                            "clientPath": rstring(path),
+                        }
+                    )
+                ]
+            )
+        return rows
+
+    def _rule_images(self, match, values, hql):
+        images = self.group.images
+        if "iids" in values:
+            image_ids = [i for i in values["iids"] if i in images]
+        elif "DatasetImageLink link" in hql:
+            # Only datasets have images in a synthetic group
+            last = values["last"]
+            image_ids = [
+                i for i in self.group.dataset_images.get(values["cid"], ()) if i > last
+            ]
+        else:
+            image_ids = []
+        return [
+            [
+                rmap(
+                    {
+                        "id": rlong(i),
+                        "name": rstring(images[i][0]),
+                        "clientPath": rstring(images[i][1]),
+                    }
+                )
+            ]
+            for i in sorted(image_ids)
+        ]
+
+    def _tag_links(self, match, values, hql):
+        links = self.group.links["Image"]
+        tag_id = values["tid"]
+        rows = []
+        for image_id in values["iids"]:
+            link = links.get((image_id, tag_id))
+            if link is not None and link[1] == values["uid"]:
+                rows.append([rlong(link[0]), rlong(image_id), rlong(tag_id)])
+        return rows
+
+    def _objects(self, obj_type):
+        if obj_type == "Image":
+            return dict((i, image[0]) for i, image in self.group.images.items())
+        if obj_type == "Dataset":
+            return dict((i, d[0]) for i, d in self.group.datasets.items())
+        return {}
+
+    def _preview(self, match, values, hql):
+        objects = self._objects(match.group(1))
+        return [
+            [
+                rmap(
+                    {
+                        "id": rlong(i),
+                        "name": rstring(objects[i]),
+                        "ownerId": rlong(self.group.user_id),
+                        "obj_details_permissions": _permissions(),
+                        "created": rtime(CREATED),
+                        "groupName": rstring(self.group.group_name),
+                    }
+                )
+            ]
+            for i in sorted(set(values["oids"]))
+            if i in objects
+        ]
+
+    def _matches(self, obj_type, tag_ids):
+        by_tag = self.group.by_tag.get(obj_type, {})
+        sets = sorted((by_tag.get(t, set()) for t in set(tag_ids)), key=len)
+        return set.intersection(*sets) if sets else set()
+
+    def _counts(self, obj_type, obj_ids):
+        by_parent = self.group.by_parent.get(obj_type, {})
+        counts = {}
+        for obj_id in obj_ids:
+            for tag_id in by_parent.get(obj_id, ()):
+                counts[tag_id] = counts.get(tag_id, 0) + 1
+        return [[rlong(t), rlong(c)] for t, c in counts.items()]
+
+    def _match_all(self, match, values, hql):
+        return [[rlong(i)] for i in self._matches(match.group(1), values["oids"])]
+
+    def _remaining(self, match, values, hql):
+        return self._counts(match.group(1), set(values["oids"]))
+
+    def _remaining_of_matches(self, match, values, hql):
+        obj_type = match.group(1)
+        return self._counts(obj_type, self._matches(obj_type, values["oids"]))
+
+    def _tag_counts(self, match, values, hql):
+        by_tag = self.group.by_tag.get(match.group(1), {})
+        return [[rlong(t), rlong(len(o))] for t, o in by_tag.items() if o]
+
+    def _match_any(self, match, values, hql):
+        by_tag = self.group.by_tag.get(match.group(1), {})
+        found = set()
+        for tag_id in values["tids"]:
+            found.update(by_tag.get(tag_id, ()))
+        if "oids" in values:
+            found.intersection_update(values["oids"])
+        return [[rlong(i)] for i in found]
+
+    def _all_links(self, match, values, hql):
+        links = self.group.sorted_links(match.group(1))
+        start = 0
+        if "lid" in values:
+            # Links after lid, as they are sorted by id
+            lo, hi = 0, len(links)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if links[mid][0] <= values["lid"]:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            start = lo
+        return [[rlong(l), rlong(p), rlong(t)] for l, p, t in links[start:]]
+
+    def _tags(self, match, values, hql):
+        applied = set()
+        for by_tag in self.group.by_tag.values():
+            applied.update(t for t, objects in by_tag.items() if objects)
+        tags = self.group.tags
+        return [
+            [rlong(t), rstring(tags[t][0])]
+            for t in sorted(applied, key=lambda t: (tags[t][0].lower(), t))
+        ]
+
+    def _groups(self, match, values, hql):
+        group = omero.model.ExperimenterGroupI(self.group.group_id, True)
+        group.name = rstring(self.group.group_name)
+        group.details.permissions = omero.model.PermissionsI(PERMISSIONS["perm"])
+        for user_id in self.group.user_ids:
+            experimenter = omero.model.ExperimenterI(user_id, True)
+            experimenter.omeName = rstring("user-%s" % user_id)
+            experimenter.firstName = rstring("User")
+            experimenter.lastName = rstring("%s" % user_id)
+            m = omero.model.GroupExperimenterMapI()
+            m.parent = group
+            m.child = experimenter
+            m.owner = rbool(user_id == self.group.user_ids[-1])
+            group.addGroupExperimenterMap(m)
+        return [group]
+
+
+class FakeUpdateService(object):
+    """
+    Update service saving tags and image tag links to a SyntheticGroup
+    """
+
+    def __init__(self, group):
+        self.group = group
+        self.saved = 0
+        self._lock = threading.Lock()
+
+    def _save(self, obj):
+        if isinstance(obj, omero.model.TagAnnotationI):
+            obj.id = rlong(self.group.add_tag(obj.textValue.val, self.group.user_id))
+        elif isinstance(obj, omero.model.ImageAnnotationLinkI):
+            key = (obj.parent.id.val, obj.child.id.val)
+            if key in self.group.links["Image"]:
+                raise omero.ValidationException(None, None, "Link already exists")
+            link_id = self.group.add_link("Image", key[0], key[1], self.group.user_id)
+            obj.id = rlong(link_id)
+        else:
+            obj.id = rlong(self.group.new_id())
+        obj.details.owner = omero.model.ExperimenterI(self.group.user_id, False)
+        obj.details.group = omero.model.ExperimenterGroupI(self.group.group_id, False)
+        self.saved += 1
+        return obj
+
+    def saveAndReturnObject(self, obj, ctx=None):
+        with self._lock:
+            return self._save(obj)
+
+    def saveAndReturnArray(self, objs, ctx=None):
+        with self._lock:
+            # Nothing is saved if any of them fail, as in a transaction
+            links = self.group.links["Image"]
+            for obj in objs:
+                if isinstance(obj, omero.model.ImageAnnotationLinkI) and (
+                    (obj.parent.id.val, obj.child.id.val) in links
+                ):
+                    raise omero.ValidationException(None, None, "Link already exists")
+            return [self._save(obj) for obj in objs]
+
+
+class FakeConnection(object):
+    """
+    The parts of BlitzGateway used by the apps, for the benchmark user
+    """
+
+    def __init__(self, group, latency=0):
+        self.group = group
+        self.query_service = FakeQueryService(group, latency)
+        self.update_service = FakeUpdateService(group)
+        self.SERVICE_OPTS = ServiceOptsDict()
+        self.SERVICE_OPTS.setOmeroGroup(group.group_id)
+        self.deleted = 0
+
+    def getQueryService(self):
+        return self.query_service
+
+    def getUpdateService(self):
+        return self.update_service
+
+    def getEventContext(self):
+        return EventContext(self.group)
+
+    def getUserId(self):
+        return self.group.user_id
+
+    def getUser(self):
+        return self.getObject("Experimenter", self.group.user_id)
+
+    def isAdmin(self):
+        return False
+
+    def isLeader(self, gid=None):
+        return False
+
+    def getObject(self, obj_type, oid):
+        if obj_type == "Dataset" and oid in self.group.datasets:
+            dataset = omero.model.DatasetI(oid, True)
+            dataset.name = rstring(self.group.datasets[oid][0])
+            return DatasetWrapper(self, dataset)
+        if obj_type != "Experimenter" or oid not in self.group.user_ids:
+            return None
+        experimenter = omero.model.ExperimenterI(oid, True)
+        experimenter.omeName = rstring("user-%s" % oid)
+        experimenter.firstName = rstring("User")
+        experimenter.lastName = rstring("%s" % oid)
+        return ExperimenterWrapper(self, experimenter)
+
+    def deleteObjects(self, graph_spec, obj_ids, wait=False, **kwargs):
+        with self.update_service._lock:
+            for obj_id in obj_ids:
+                if self.group.remove_link(obj_id):
+                    self.deleted += 1
+
+    def close(self, hard=True):
+        pass
+
+    def counts(self):
+        """
+        Get the number of queries, rows returned, objects saved and objects
+        deleted so far
+        """
+
+        return (
+            self.query_service.queries,
+            self.query_service.rows,
+            self.update_service.saved,
+            self.deleted,
+        )
+
+
+def job_connector(request, conn):
+    """
+    Stand-in for omero_webtagging_autotag.views._job_connector, whose jobs
+    use the same fake connection as the request
+    """
+
+    return lambda: conn
+
+
+def marshal_tags(conn, group_id=-1, **kwargs):
+    """
+    Stand-in for omeroweb.webclient.tree.marshal_tags
+    """
+
+    from omeroweb.webclient import tree
+
+    return [
+        tree._marshal_tag(
+            conn, [tag_id, value, None, owner_id, dict(PERMISSIONS), None, 0]
+        )
+        for tag_id, (value, owner_id) in sorted(conn.group.tags.items())
+    ]
+
+
+def marshal_experimenters(conn, group_id=-1, **kwargs):
+    """
+    Stand-in for omeroweb.webclient.tree.marshal_experimenters
+    """
+
+    return [
+        {
+            "id": user_id,
+            "omeName": "user-%s" % user_id,
+            "firstName": "User",
+            "lastName": "%s" % user_id,
+        }
+        for user_id in conn.group.user_ids
+    ]
@@ -0,0 +1,399 @@
+"""
+Benchmark the views of autotag and tagsearch against synthetic groups
+
+Each view is called with a request from Django's RequestFactory and a
+FakeConnection, so no OMERO server is needed, only omero-py and omero-web.
+The views are called without their decorators, which need a real session
+with the server, so the group context they would set is set on the fake
+connection instead. omeroweb.webclient.tree's marshal_tags and
+marshal_experimenters are replaced too, as they run queries of OMERO.web's
+rather than of the apps.
+
+See benchmarks/README.md
+"""
+
+from __future__ import print_function
+from builtins import object, range
+import argparse
+from importlib import import_module
+import inspect
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "autotag"), os.path.join(ROOT, "tagsearch")]
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from omeroweb.webclient import tree  # noqa: E402
+from omero_webtagging_autotag import views as autotag_views  # noqa: E402
+from omero_webtagging_tagsearch import views as tagsearch_views  # noqa: E402
+from omero_webtagging_tagsearch import groups, tag_index, utils  # noqa: E402
+from omero_webtagging_tagsearch.result_cache import result_cache  # noqa: E402
+from benchmarks import fake_gateway  # noqa: E402
+from benchmarks.synthetic import SyntheticGroup  # noqa: E402
+
+# Requests whose body is JSON are posted as the autotag UI posts them
+FORM = "application/x-www-form-urlencoded"
+
+
+class Benchmark(object):
+    """
+    Requests for each of the benchmarked views against a group
+    """
+
+    def __init__(self, group, options):
+        self.group = group
+        self.options = options
+        self.factory = RequestFactory()
+        popular = group.tags_by_popularity()
+        self.search_tags = popular[:2]
+        self.any_tags = popular[2:4]
+        self.excluded_tags = popular[4:5]
+        self.image_ids = sorted(group.images)[: options.selection]
+
+    def _request(self, method, path, data=None, content_type=None):
+        if method == "GET":
+            request = self.factory.get(path, data or {})
+        elif content_type is not None:
+            request = self.factory.post(path, data, content_type=content_type)
+        else:
+            request = self.factory.post(path, data or {})
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session["active_group"] = self.group.group_id
+        session["user_id"] = self.group.user_id
+        session.save()
+        request.session = session
+        return request
+
+    def _until_done(self, view):
+        """
+        Wrap a view submitting a job so that it polls the progress of the
+        job until it has finished
+        """
+
+        progress = inspect.unwrap(autotag_views.process_update_progress)
+
+        def run_job(request, conn):
+            response = inspect.unwrap(view)(request, conn=conn)
+            job = json.loads(response.content)
+            while job["status"] in ("queued", "running"):
+                time.sleep(0.001)
+                path = "/autotag/auto_tag/processUpdate/%s/" % job["jobId"]
+                response = progress(self._request("GET", path), job["jobId"], conn=conn)
+                job = json.loads(response.content)
+            if job["status"] != "done":
+                raise RuntimeError("Job %s: %s" % (job["status"], job["error"]))
+            return response
+
+        run_job.__name__ = view.__name__
+        return run_job
+
+    def _mapping(self):
+        # Rules for the most popular tags, whose values are in image paths
+        return dict((self.group.tags[t][0], t) for t in self.search_tags)
+
+    def get_image_detail_and_tags(self, i):
+        return autotag_views.get_image_detail_and_tags, self._request(
+            "POST",
+            "/autotag/get_image_detail_and_tags/",
+            {"imageIds[]": self.image_ids, "tokenIndex": "true"},
+        )
+
+    def stream_image_detail_and_tags(self, i):
+        return autotag_views.stream_image_detail_and_tags, self._request(
+            "POST",
+            "/autotag/get_image_detail_and_tags/stream/",
+            {"imageIds[]": self.image_ids, "tokenIndex": "true"},
+        )
+
+    def _update(self, i):
+        # Different links each time, as the last ones were already applied
+        rand = random.Random(i)
+        image_ids = sorted(self.group.images)
+        tag_ids = sorted(self.group.tags)
+        links = self.group.links["Image"]
+        additions = {}
+        removals = {}
+        for n in range(self.options.update_size):
+            image_id = rand.choice(image_ids)
+            tag_id = rand.choice(tag_ids)
+            if (image_id, tag_id) not in links:
+                additions.setdefault(tag_id, []).append(image_id)
+            linked = sorted(self.group.by_parent["Image"].get(image_id, ()))
+            if linked:
+                removals.setdefault(rand.choice(linked), []).append(image_id)
+        return json.dumps({"additions": additions, "removals": removals})
+
+    def process_update(self, i):
+        return autotag_views.process_update, self._request(
+            "POST", "/autotag/auto_tag/processUpdate/", self._update(i), FORM
+        )
+
+    def process_update_async(self, i):
+        return self._until_done(autotag_views.process_update), self._request(
+            "POST",
+            "/autotag/auto_tag/processUpdate/?async=true",
+            self._update(i),
+            FORM,
+        )
+
+    def apply_container_rules(self, i):
+        rules = [{"tagId": t, "token": v} for v, t in self._mapping().items()]
+        return self._until_done(autotag_views.apply_container_rules), self._request(
+            "POST",
+            "/autotag/auto_tag/rules/",
+            json.dumps(
+                {
+                    "containerType": "Dataset",
+                    "containerId": min(self.group.datasets),
+                    "rules": rules,
+                }
+            ),
+            FORM,
+        )
+
+    def diff_rules(self, i):
+        return autotag_views.diff_rules, self._request(
+            "POST",
+            "/autotag/auto_tag/diff/",
+            json.dumps(
+                {
+                    "imageIds": [[self.image_ids[0], self.image_ids[-1]]],
+                    "mapping": self._mapping(),
+                    "exact": True,
+                }
+            ),
+            FORM,
+        )
+
+    def create_tag(self, i):
+        return autotag_views.create_tag, self._request(
+            "POST",
+            "/autotag/create_tag/",
+            json.dumps({"value": "benchmark%s" % i, "description": None}),
+            FORM,
+        )
+
+    def index(self, i):
+        return tagsearch_views.index, self._request("GET", "/tagsearch/")
+
+    def tag_image_search(self, i):
+        return tagsearch_views.tag_image_search, self._request(
+            "POST",
+            "/tagsearch/images",
+            {"selectedTags": self.search_tags, "results_preview": "true"},
+        )
+
+    def tag_image_search_boolean(self, i):
+        return tagsearch_views.tag_image_search, self._request(
+            "POST",
+            "/tagsearch/images",
+            {
+                "selectedTags": self.search_tags[:1],
+                "anyTags": self.any_tags,
+                "excludedTags": self.excluded_tags,
+                "results_preview": "true",
+            },
+        )
+
+
+SCENARIOS = (
+    "get_image_detail_and_tags",
+    "stream_image_detail_and_tags",
+    "process_update",
+    "process_update_async",
+    "apply_container_rules",
+    "diff_rules",
+    "create_tag",
+    "index",
+    "tag_image_search",
+    "tag_image_search_boolean",
+)
+
+
+def clear_caches(group):
+    """
+    Clear everything cached by the apps, so that each run does the work of
+    the first request after a change
+    """
+
+    cache.clear()
+    result_cache.invalidate_group(group.group_id)
+    with tag_index._lock:
+        tag_index._indexes.clear()
+    with groups._lock:
+        groups._groups.clear()
+    with utils._group_read_lock:
+        utils._group_read.clear()
+
+
+def run(conn, view, request):
+    """
+    Call a view without its decorators
+
+    @return:                Tuple of the seconds taken and the differences in
+                            conn.counts()
+    """
+
+    before = conn.counts()
+    start = time.perf_counter()
+    response = inspect.unwrap(view)(request, conn=conn)
+    if getattr(response, "streaming", False):
+        # The work is done as the response is streamed
+        for _ in response.streaming_content:
+            pass
+    seconds = time.perf_counter() - start
+    status = getattr(response, "status_code", 200)
+    if status >= 400:
+        raise RuntimeError(
+            "%s returned %s: %s" % (view.__name__, status, response.content[:200])
+        )
+    return seconds, [a - b for a, b in zip(conn.counts(), before)]
+
+
+def benchmark(group, options):
+    conn = fake_gateway.FakeConnection(group, options.latency / 1000.0)
+    bench = Benchmark(group, options)
+    results = []
+    for name in options.scenarios:
+        times = []
+        for i in range(options.repeat):
+            if not options.warm:
+                clear_caches(group)
+            view, request = getattr(bench, name)(i)
+            seconds, counts = run(conn, view, request)
+            times.append(seconds)
+
+        # Measured separately, as tracing allocations slows everything down
+        if not options.warm:
+            clear_caches(group)
+        view, request = getattr(bench, name)(options.repeat)
+        tracemalloc.start()
+        run(conn, view, request)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results.append(
+            {
+                "scenario": name,
+                "median_ms": statistics.median(times) * 1000,
+                "max_ms": max(times) * 1000,
+                "queries": counts[0],
+                "rows": counts[1],
+                "saved": counts[2],
+                "deleted": counts[3],
+                "peak_mb": peak / 1024.0 / 1024,
+            }
+        )
+    return results
+
+
+def report(scale, results):
+    print(
+        "\n%(links)s links, %(images)s images, %(tags)s tags "
+        "(generated in %(generate_s).1fs)" % scale
+    )
+    columns = ("median ms", "max ms", "queries", "rows", "saved", "deleted", "peak MB")
+    print("%-28s %10s %10s %8s %10s %8s %8s %8s" % (("scenario",) + columns))
+    for r in results:
+        print(
+            "%(scenario)-28s %(median_ms)10.1f %(max_ms)10.1f %(queries)8d "
+            "%(rows)10d %(saved)8d %(deleted)8d %(peak_mb)8.1f" % r
+        )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--links",
+        default="1000,10000,100000,1000000",
+        help="Comma separated numbers of image tag links to benchmark with",
+    )
+    parser.add_argument(
+        "--links-per-image", type=int, default=10, help="Tags linked to each image"
+    )
+    parser.add_argument("--tags", type=int, default=500, help="Tags in the group")
+    parser.add_argument(
+        "--selection",
+        type=int,
+        default=1000,
+        help="Images requested from get_image_detail_and_tags",
+    )
+    parser.add_argument(
+        "--update-size",
+        type=int,
+        default=100,
+        help="Links added and removed by each process_update",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Times each view is timed"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0,
+        help="Milliseconds added to every query to simulate the server",
+    )
+    parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="Keep the caches of the apps between runs",
+    )
+    parser.add_argument(
+        "--scenario",
+        dest="scenarios",
+        action="append",
+        choices=SCENARIOS,
+        help="Only run this scenario, may be repeated",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    options = parser.parse_args(argv)
+    options.scenarios = options.scenarios or list(SCENARIOS)
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    output = []
+    with mock.patch.object(
+        tree, "marshal_tags", fake_gateway.marshal_tags
+    ), mock.patch.object(
+        tree, "marshal_experimenters", fake_gateway.marshal_experimenters
+    ), mock.patch.object(
+        autotag_views, "_job_connector", fake_gateway.job_connector
+    ):
+        for links in [int(n) for n in options.links.split(",")]:
+            images = max(1, links // options.links_per_image)
+            start = time.perf_counter()
+            group = SyntheticGroup(images, options.tags, links, seed=options.seed)
+            scale = {
+                "links": group.count_links(),
+                "images": images,
+                "tags": options.tags,
+                "generate_s": time.perf_counter() - start,
+            }
+            results = benchmark(group, options)
+            report(scale, results)
+            output.append({"scale": scale, "results": results})
+
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""
+Django settings for the benchmarks, those of OMERO.web with both apps added
+"""
+
+from omeroweb.settings import *  # noqa: F401,F403
+
+for app in ("omero_webtagging_autotag", "omero_webtagging_tagsearch"):
+    if app not in INSTALLED_APPS:  # noqa: F405
+        INSTALLED_APPS = tuple(INSTALLED_APPS) + (app,)  # noqa: F405
+
+ROOT_URLCONF = "benchmarks.urls"
+
+# Each benchmark process has its own cache, so runs do not affect each other
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
@@ -0,0 +1,172 @@
+"""
+Synthetic groups of images, tags and tag links
+"""
+
+from builtins import object, range
+import random
+
+# Object types which are tagged in a synthetic group, the others have no links
+TAGGED_TYPES = ("Image", "Dataset")
+
+# Images per dataset
+DATASET_SIZE = 100
+
+# Tags linked to each dataset
+TAGS_PER_DATASET = 2
+
+
+class SyntheticGroup(object):
+    """
+    A group of users, images, datasets and tags with links between them
+
+    Tag popularity follows a Zipf distribution, so that searches for
+    different tags match very different numbers of objects as they do in
+    real data. Each image's client path is made of the values of some of its
+    tags, so that auto-tagging its path finds them. The links all belong to
+    the benchmark user, so that any of them can be removed by it.
+
+    @param images:          Number of images
+    @param tags:            Number of tags
+    @param links:           Approximate number of image tag links
+    @param users:           Number of users in the group, the first of whom is
+                            the one the benchmarks are run as
+    @param seed:            Seed of the random generator
+    """
+
+    def __init__(self, images, tags, links, users=5, seed=0):
+        self.random = random.Random(seed)
+        self.group_id = 3
+        self.group_name = "benchmark"
+        self.user_ids = list(range(2, 2 + users))
+        self.user_id = self.user_ids[0]
+        self.next_id = 1
+
+        self.tags = {}
+        for i in range(tags):
+            self.tags[self._id()] = ("tag%05d" % i, self._owner())
+        tag_ids = sorted(self.tags)
+        cum_weights = []
+        total = 0.0
+        for rank in range(len(tag_ids)):
+            total += 1.0 / (rank + 1)
+            cum_weights.append(total)
+
+        self.images = {}
+        self.datasets = {}
+        # Dataset id -> list of the ids of its images
+        self.dataset_images = {}
+        self.links = dict((obj_type, {}) for obj_type in TAGGED_TYPES)
+        self.by_tag = dict((obj_type, {}) for obj_type in TAGGED_TYPES)
+        self.by_parent = dict((obj_type, {}) for obj_type in TAGGED_TYPES)
+        # Link id -> (object type, parent id, tag id)
+        self.link_ids = {}
+        self._sorted_links = {}
+
+        per_image = max(1, min(len(tag_ids), int(round(float(links) / images))))
+        dataset_id = None
+        for i in range(images):
+            if i % DATASET_SIZE == 0:
+                dataset_id = self._id()
+                self.datasets[dataset_id] = ("dataset%05d" % len(self.datasets),)
+                self.dataset_images[dataset_id] = []
+                for tag_id in self.random.sample(tag_ids, TAGS_PER_DATASET):
+                    self.add_link("Dataset", dataset_id, tag_id, self.user_id)
+
+            image_id = self._id()
+            image_tags = set()
+            while len(image_tags) < per_image:
+                image_tags.update(
+                    self.random.choices(
+                        tag_ids, cum_weights=cum_weights, k=per_image - len(image_tags)
+                    )
+                )
+            path = "/".join(
+                [""]
+                + [self.tags[t][0] for t in sorted(image_tags)[:3]]
+                + ["image%07d.tif" % i]
+            )
+            self.images[image_id] = ("image%07d" % i, path, self._id(), self._owner())
+            self.dataset_images[dataset_id].append(image_id)
+            for tag_id in image_tags:
+                self.add_link("Image", image_id, tag_id, self.user_id)
+
+    def _id(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+    def _owner(self):
+        # Half of everything belongs to the benchmark user
+        if self.random.random() < 0.5:
+            return self.user_id
+        return self.random.choice(self.user_ids)
+
+    def add_link(self, obj_type, parent_id, tag_id, owner_id):
+        """
+        Link a tag to an object
+
+        @return:            The id of the link
+        """
+
+        link_id = self._id()
+        self.links[obj_type][(parent_id, tag_id)] = (link_id, owner_id)
+        self.link_ids[link_id] = (obj_type, parent_id, tag_id)
+        self.by_tag[obj_type].setdefault(tag_id, set()).add(parent_id)
+        self.by_parent[obj_type].setdefault(parent_id, set()).add(tag_id)
+        self._sorted_links.pop(obj_type, None)
+        return link_id
+
+    def remove_link(self, link_id):
+        """
+        Unlink a tag from an object
+
+        @return:            Whether the link existed
+        """
+
+        if link_id not in self.link_ids:
+            return False
+        obj_type, parent_id, tag_id = self.link_ids.pop(link_id)
+        del self.links[obj_type][(parent_id, tag_id)]
+        self.by_tag[obj_type][tag_id].discard(parent_id)
+        self.by_parent[obj_type][parent_id].discard(tag_id)
+        self._sorted_links.pop(obj_type, None)
+        return True
+
+    def add_tag(self, value, owner_id):
+        tag_id = self._id()
+        self.tags[tag_id] = (value, owner_id)
+        return tag_id
+
+    def new_id(self):
+        """
+        Get an id for any other object saved to the group
+        """
+
+        return self._id()
+
+    def sorted_links(self, obj_type):
+        """
+        Get the links of obj_type as a list of (link id, parent id, tag id)
+        sorted by link id
+        """
+
+        links = self._sorted_links.get(obj_type)
+        if links is None:
+            links = sorted(
+                (link_id, parent_id, tag_id)
+                for (parent_id, tag_id), (link_id, owner_id) in self.links.get(
+                    obj_type, {}
+                ).items()
+            )
+            self._sorted_links[obj_type] = links
+        return links
+
+    def count_links(self):
+        return sum(len(links) for links in self.links.values())
+
+    def tags_by_popularity(self):
+        """
+        Get the ids of the tags ordered from most to least linked images
+        """
+
+        by_tag = self.by_tag["Image"]
+        return sorted(self.tags, key=lambda t: -len(by_tag.get(t, ())))
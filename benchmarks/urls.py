@@ -0,0 +1,11 @@
+"""
+URLs of OMERO.web and both apps, which the views and templates reverse
+"""
+
+from django.conf.urls import include, url
+from omeroweb.urls import urlpatterns
+
+urlpatterns = [
+    url(r"^autotag/", include("omero_webtagging_autotag.urls")),
+    url(r"^tagsearch/", include("omero_webtagging_tagsearch.urls")),
+] + urlpatterns
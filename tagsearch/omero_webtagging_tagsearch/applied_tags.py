@@ -0,0 +1,119 @@
+from bisect import bisect_left
+from django.core.cache import cache
+from omero.sys import Parameters
+from . import tagsearch_settings
+from .tag_index import OBJECT_TYPES
+from .timing import timed_query_service
+from .utils import tag_links_generation, visibility_key
+
+
+def query_applied_tags(conn, group_id):
+    """
+    Get the tags which are applied to anything in a group
+
+    It is not sufficient to simply get the tags as there may be tags which are
+    not applied which don't really make sense to display
+
+    @return:                List of (id, value) sorted by value
+    """
+
+    qs = timed_query_service(conn, "applied_tags")
+    service_opts = conn.SERVICE_OPTS.copy()
+    service_opts.setOmeroGroup(group_id)
+
+    # One query covering every type of link rather than one per type
+    applied = " OR ".join(
+        "EXISTS (SELECT link.id FROM %sAnnotationLink link "
+        "WHERE link.child.id = tag.id)" % obj_type
+        for obj_type in OBJECT_TYPES
+    )
+    hql = """
+        SELECT tag.id, tag.textValue
+        FROM TagAnnotation tag
+        WHERE %s
+        ORDER BY lower(tag.textValue), tag.id
+    """ % applied
+
+    return [
+        (result[0].val, result[1].val)
+        for result in qs.projection(hql, Parameters(), service_opts)
+    ]
+
+
+def cached_for_group(conn, group_id, name, load):
+    """
+    Get a value derived from the applied tags of a group from the cache,
+    loading and caching it for TAG_CACHE_TTL seconds if necessary
+
+    The value is cached for the current generation of the tag links of the
+    group, so it is reloaded once they change
+    """
+
+    ttl = tagsearch_settings.TAG_CACHE_TTL
+    if ttl <= 0:
+        return load()
+
+    visibility = visibility_key(conn, group_id)
+    generation = tag_links_generation(visibility[0])
+    key = "omero_webtagging_tagsearch:%s:%s:%s:%s" % (
+        name,
+        visibility[0],
+        visibility[1],
+        generation,
+    )
+    value = cache.get(key)
+    if value is None:
+        value = load()
+        cache.set(key, value, ttl)
+    return value
+
+
+def get_applied_tags(conn, group_id):
+    """
+    Get the tags which are applied to anything in a group, cached for
+    TAG_CACHE_TTL seconds
+
+    @return:                List of (id, value) sorted by value
+    """
+
+    return cached_for_group(
+        conn, group_id, "applied", lambda: query_applied_tags(conn, group_id)
+    )
+
+
+def get_prefix_index(conn, group_id):
+    """
+    Get the applied tags of a group as a list of (lowercase value, id, value)
+    sorted for prefix searches, cached for TAG_CACHE_TTL seconds
+    """
+
+    return cached_for_group(
+        conn,
+        group_id,
+        "prefix_index",
+        lambda: sorted(
+            (value.lower(), tag_id, value)
+            for tag_id, value in get_applied_tags(conn, group_id)
+        ),
+    )
+
+
+def search_tags(conn, group_id, prefix, limit):
+    """
+    Get the applied tags of a group which start with prefix, ignoring case
+
+    @return:                List of up to limit (id, value) sorted by value
+    """
+
+    index = get_prefix_index(conn, group_id)
+    prefix = prefix.lower()
+
+    matches = []
+    i = bisect_left(index, (prefix,))
+    while i < len(index) and len(matches) < limit:
+        lower, tag_id, value = index[i]
+        if not lower.startswith(prefix):
+            break
+        matches.append((tag_id, value))
+        i += 1
+    return matches
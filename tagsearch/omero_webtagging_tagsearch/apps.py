@@ -7,3 +7,16 @@ from django.apps import AppConfig
 class TagsearchAppConfig(AppConfig):
     name = "omero_webtagging_tagsearch"
     label = "omero_webtagging_tagsearch"
+
+    def ready(self):
+        try:
+            from omero_webtagging_autotag.signals import tag_links_changed
+        except ImportError:
+            # autotag is not installed, so there are no changes to hear about
+            return
+        from . import result_cache, tag_index
+
+        # The index receiver also starts the new generation of the tag links,
+        # which invalidates the applied tags and results in every process
+        tag_links_changed.connect(tag_index.on_tag_links_changed)
+        tag_links_changed.connect(result_cache.on_tag_links_changed)
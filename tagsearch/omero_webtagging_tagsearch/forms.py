@@ -3,6 +3,8 @@ from django.forms import Form, MultipleChoiceField, BooleanField
 
 class TagSearchForm(Form):
     selectedTags = MultipleChoiceField()
+    anyTags = MultipleChoiceField(required=False)
+    excludedTags = MultipleChoiceField(required=False)
     results_preview = BooleanField()
 
     def __init__(self, tags, conn=None, *args, **kwargs):
@@ -10,4 +12,6 @@ class TagSearchForm(Form):
 
         # Process Tags into choices (lists of tuples)
         self.fields["selectedTags"].choices = tags
+        self.fields["anyTags"].choices = tags
+        self.fields["excludedTags"].choices = tags
         self.conn = conn
@@ -0,0 +1,103 @@
+import threading
+import time
+import omero
+from omero.gateway import ExperimenterGroupWrapper, ExperimenterWrapper
+from . import tagsearch_settings
+from .timing import timed_query_service
+
+# Loaded groups cached per session, session key -> (time loaded, groups)
+_groups = {}
+_lock = threading.Lock()
+
+
+def query_groups(conn, group_ids=None):
+    """
+    Load groups along with all their members in a single query
+
+    @param group_ids:       Ids of the groups to load, or None for all groups
+    @return:                List of omero.model.ExperimenterGroup
+    """
+
+    params = omero.sys.ParametersI()
+    hql = (
+        "select distinct g from ExperimenterGroup g "
+        "left outer join fetch g.groupExperimenterMap m "
+        "left outer join fetch m.child "
+    )
+    if group_ids is not None:
+        hql += "where g.id in (:gids)"
+        params.addLongs("gids", group_ids)
+
+    qs = timed_query_service(conn, "groups")
+    return qs.findAllByQuery(hql, params, conn.SERVICE_OPTS)
+
+
+def summarise_group(conn, group):
+    """
+    Set the leaders and colleagues of a group from its already loaded members,
+    as ExperimenterGroupWrapper.groupSummary does from a query of its own
+    """
+
+    leaders = []
+    colleagues = []
+    is_leader = conn.isLeader(group.getId())
+    if not group.isPrivate() or is_leader or conn.isAdmin():
+        for m in group._obj.copyGroupExperimenterMap():
+            if m is None:
+                continue
+            if m.owner.val:
+                leaders.append(ExperimenterWrapper(conn, m.child))
+            else:
+                colleagues.append(ExperimenterWrapper(conn, m.child))
+    else:
+        if is_leader:
+            leaders = [conn.getUser()]
+        else:
+            colleagues = [conn.getUser()]
+
+    # sort them by lastName
+    leaders.sort(key=lambda x: x.getLastName().lower())
+    colleagues.sort(key=lambda x: x.getLastName().lower())
+    group.leaders = leaders
+    group.colleagues = colleagues
+    return group
+
+
+def get_groups(conn, session_key):
+    """
+    Get the groups the user can switch to with their leaders and colleagues
+
+    The groups are loaded in one query and cached per session for
+    GROUP_CACHE_TTL seconds, so this costs at most one round trip however
+    many groups there are.
+    """
+
+    ttl = tagsearch_settings.GROUP_CACHE_TTL
+    now = time.time()
+    with _lock:
+        cached = _groups.get(session_key)
+        # Drop anything expired while here
+        for key in [k for k, v in _groups.items() if v[0] < now - ttl]:
+            del _groups[key]
+
+    if cached is not None and cached[0] >= now - ttl:
+        groups = cached[1]
+    else:
+        if conn.isAdmin():  # Admin can see all groups
+            groups = [
+                g for g in query_groups(conn) if g.name.val not in ("user", "guest")
+            ]
+        else:
+            groups = [
+                g
+                for g in query_groups(conn, conn.getEventContext().memberOfGroups)
+                if g.name.val != "user"
+            ]
+        if ttl > 0 and session_key is not None:
+            with _lock:
+                _groups[session_key] = (now, groups)
+
+    # The cached model objects are wrapped afresh for this connection
+    groups = [summarise_group(conn, ExperimenterGroupWrapper(conn, g)) for g in groups]
+    groups.sort(key=lambda x: x.getName().lower())
+    return groups
@@ -0,0 +1,57 @@
+from builtins import object
+from collections import OrderedDict
+import threading
+import time
+
+
+class ResultCache(object):
+    """
+    Least recently used cache of search results which expire after a time
+
+    Keys must be tuples starting with the group id, so that the results of a
+    group can be invalidated when its tag links change
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None and result[0] < time.time() - self.ttl:
+                del self._results[key]
+                result = None
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._results.move_to_end(key)
+            return result[1]
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._results[key] = (time.time(), value)
+            self._results.move_to_end(key)
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+
+    def invalidate_group(self, group_id):
+        with self._lock:
+            for key in [k for k in self._results if k[0] == group_id]:
+                del self._results[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._results),
+                "capacity": self.size,
+            }
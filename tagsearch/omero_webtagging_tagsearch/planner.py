@@ -0,0 +1,66 @@
+import omero
+from .applied_tags import cached_for_group
+from .tag_index import OBJECT_TYPES
+from .timing import timed_query_service
+from .utils import chunked_projection
+
+
+def query_tag_counts(conn, group_id):
+    """
+    Get the number of objects of each type linked to each tag in a group
+
+    @return:                Dict of object type -> tag id -> count
+    """
+
+    qs = timed_query_service(conn, "tag_counts")
+    service_opts = conn.SERVICE_OPTS.copy()
+    service_opts.setOmeroGroup(group_id)
+
+    counts = {}
+    for obj_type in OBJECT_TYPES:
+        hql = (
+            "select link.child.id, count(link.id) from %sAnnotationLink link "
+            "where link.child.class is TagAnnotation "
+            "group by link.child.id" % obj_type
+        )
+        counts[obj_type] = dict(
+            (e[0].val, e[1].val)
+            for e in qs.projection(hql, omero.sys.ParametersI(), service_opts)
+        )
+    return counts
+
+
+def get_tag_counts(conn, group_id):
+    """
+    Get the number of objects of each type linked to each tag in a group,
+    cached along with the group's applied tags
+    """
+
+    return cached_for_group(
+        conn, group_id, "counts", lambda: query_tag_counts(conn, group_id)
+    )
+
+
+def query_fetcher(conn, obj_type, service_opts):
+    """
+    Get a fetch function for evaluate which queries the server, only passing
+    in the candidates matched so far
+    """
+
+    qs = timed_query_service(conn, "match")
+
+    def fetch(tag_ids, candidates):
+        params = omero.sys.ParametersI()
+        params.addLongs("tids", tag_ids)
+        hql = (
+            "select distinct link.parent.id from %sAnnotationLink link "
+            "where link.child.id in (:tids)" % obj_type
+        )
+        if candidates is None:
+            rows = qs.projection(hql, params, service_opts)
+        else:
+            hql += " and link.parent.id in (:oids)"
+            rows = chunked_projection(qs, hql, candidates, service_opts, params=params)
+        return set(e[0].val for e in rows)
+
+    return fetch
@@ -0,0 +1,14 @@
+from . import tagsearch_settings
+from .lru_cache import ResultCache
+
+result_cache = ResultCache(
+    tagsearch_settings.RESULT_CACHE_SIZE, tagsearch_settings.RESULT_CACHE_TTL
+)
+
+
+def on_tag_links_changed(sender, group_id, **kwargs):
+    """
+    Drop the cached results of a group when its tag links change
+    """
+
+    result_cache.invalidate_group(group_id)
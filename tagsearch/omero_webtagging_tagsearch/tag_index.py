@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+import omero
+from . import tagsearch_settings
+from .tag_links import OBJECT_TYPES, TagLinks
+from .timing import timed_query_service
+from .utils import invalidate_tag_links, tag_links_generation, visibility_key
+
+logger = logging.getLogger(__name__)
+
+# Number of links loaded per query when building an index
+LOAD_PAGE_SIZE = 50000
+
+_indexes = {}
+_build_locks = {}
+# Key -> list of the changes made while its index is being built, and the
+# generation of the tag links they started, to replay onto it before it is
+# used, or None if it must not be used
+_building = {}
+_lock = threading.Lock()
+
+
+class TagLinkIndex(TagLinks):
+    """
+    In-memory index of the tag links of a group, loaded from the server
+    """
+
+    def __init__(self):
+        super(TagLinkIndex, self).__init__()
+        self.built = None
+        # Generation of the tag links of the group which the index is of
+        self.generation = None
+
+    def load(self, conn, service_opts):
+        """
+        Load all the tag links visible in the context of service_opts
+        """
+
+        qs = timed_query_service(conn, "index_load")
+        for obj_type in OBJECT_TYPES:
+            hql = (
+                "select link.id, link.parent.id, link.child.id "
+                "from %sAnnotationLink link "
+                "where link.child.class is TagAnnotation "
+                "and link.id > :lid "
+                "order by link.id" % obj_type
+            )
+            # Page by link id rather than offset, which gets slower with
+            # every page
+            last_id = -1
+            while True:
+                params = omero.sys.ParametersI()
+                params.addLong("lid", last_id)
+                params.page(0, LOAD_PAGE_SIZE)
+                rows = qs.projection(hql, params, service_opts)
+                # The links are in order of link id, so the arrays are only
+                # sorted once they are all loaded
+                self.extend(obj_type, ((row[1].val, row[2].val) for row in rows))
+                if len(rows) < LOAD_PAGE_SIZE:
+                    break
+                last_id = rows[-1][0].val
+            self.sort(obj_type)
+        self.built = time.time()
+
+
+def _is_fresh(index, generation):
+    return (
+        index is not None
+        and index.generation == generation
+        and index.built >= time.time() - tagsearch_settings.INDEX_TTL
+    )
+
+
+def get_index(conn, group_id):
+    """
+    Get the index of the tag links of a group, building it if necessary
+
+    Indexes are rebuilt once they are older than INDEX_TTL seconds, or once
+    the tag links of the group have been changed by autotag in another
+    process. Until the rebuild is complete, the previous index continues to
+    be used by any search already holding it. Links changed by autotag in
+    this process during the rebuild are applied to the new index before it
+    replaces the previous one.
+    """
+
+    key = visibility_key(conn, group_id)
+    with _lock:
+        index = _indexes.get(key)
+        build_lock = _build_locks.setdefault(key, threading.Lock())
+
+    if _is_fresh(index, tag_links_generation(key[0])):
+        return index
+
+    # Only build each index once, even if it is needed by concurrent searches
+    with build_lock:
+        with _lock:
+            index = _indexes.get(key)
+        generation = tag_links_generation(key[0])
+        if _is_fresh(index, generation):
+            return index
+
+        start = time.time()
+        service_opts = conn.SERVICE_OPTS.copy()
+        service_opts.setOmeroGroup(group_id)
+        index = TagLinkIndex()
+        index.generation = generation
+        with _lock:
+            _building[key] = []
+        try:
+            index.load(conn, service_opts)
+        except Exception:
+            with _lock:
+                del _building[key]
+            raise
+
+        with _lock:
+            changes = _building.pop(key)
+            # Links changed while loading may have been loaded or not, so the
+            # changes are replayed, in order, before any more can be made
+            if changes is not None:
+                for obj_type, added, removed, changed in changes:
+                    index.apply(obj_type, added, removed, replay=True)
+                    # Unless the links were also changed by another process
+                    if index.generation == changed - 1:
+                        index.generation = changed
+                _indexes[key] = index
+        logger.info("Built tag link index for %s in %ss" % (key, time.time() - start))
+    return index
+
+
+def on_tag_links_changed(sender, group_id, user_id, added, removed, **kwargs):
+    """
+    Apply image tag links changed by autotag to the indexes of their group
+
+    The changes are applied to the index shared by the group and to the index
+    of the user who made them, or recorded to be applied to them if they are
+    being built. Any other per-user index of the group is dropped, or not
+    kept once built, as whether the changes are visible to that user is not
+    known.
+
+    A new generation of the tag links of the group is then started, so that
+    the indexes of other processes are rebuilt. The indexes changed here are
+    of the new generation, unless the links were also changed by another
+    process since they were built.
+    """
+
+    with _lock:
+        keys = [key for key in _indexes if key[0] == group_id]
+        for key in keys:
+            if key[1] is not None and key[1] != user_id:
+                del _indexes[key]
+        indexes = [_indexes[key] for key in keys if key in _indexes]
+
+    for index in indexes:
+        index.apply("Image", added, removed)
+
+    generation = invalidate_tag_links(group_id)
+
+    with _lock:
+        for index in indexes:
+            if index.generation == generation - 1:
+                index.generation = generation
+        for key in [key for key in _building if key[0] == group_id]:
+            if key[1] is not None and key[1] != user_id:
+                _building[key] = None
+            elif _building[key] is not None:
+                _building[key].append(("Image", added, removed, generation))
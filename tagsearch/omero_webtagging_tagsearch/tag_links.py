@@ -0,0 +1,268 @@
+from builtins import object
+from array import array
+from bisect import bisect_left
+from collections import Counter
+import threading
+
+# The types of object which can be tagged and searched for
+OBJECT_TYPES = ("Image", "Dataset", "Project", "Screen", "Plate", "PlateAcquisition")
+
+
+def _contains(ids, value):
+    i = bisect_left(ids, value)
+    return i < len(ids) and ids[i] == value
+
+
+def _merge(ids, changes):
+    """
+    Make a copy of a sorted array of ids with changes made to it
+
+    The unchanged runs of ids between the changes are copied as slices, so
+    this is linear in the length of the array, in C, however many changes
+    there are.
+
+    @param changes:         Sorted list of (id, True to add or False to
+                            remove), of ids which are not, or are,
+                            respectively, in the array
+    @return:                Sorted array
+    """
+
+    result = array("q")
+    i = 0
+    for value, add in changes:
+        j = bisect_left(ids, value, i)
+        result += ids[i:j]
+        if add:
+            result.append(value)
+            i = j
+        else:
+            i = j + 1
+    result += ids[i:]
+    return result
+
+
+def intersect(a, b):
+    """
+    Intersect two sorted arrays of ids
+
+    The arrays are merged, unless one is much shorter, when each of its ids
+    is looked up in the other by bisection instead
+
+    @return:                Sorted array of the ids in both
+    """
+
+    if len(a) > len(b):
+        a, b = b, a
+    result = array("q")
+    n = len(a)
+    m = len(b)
+    if n * 4 < m:
+        j = 0
+        for x in a:
+            j = bisect_left(b, x, j)
+            if j == m:
+                break
+            if b[j] == x:
+                result.append(x)
+        return result
+
+    i = j = 0
+    while i < n and j < m:
+        x = a[i]
+        y = b[j]
+        if x < y:
+            i += 1
+        elif y < x:
+            j += 1
+        else:
+            result.append(x)
+            i += 1
+            j += 1
+    return result
+
+
+class TagLinks(object):
+    """
+    The tag links of a group
+
+    For each object type this holds a sorted array of the ids of the objects
+    linked to each tag and of the ids of the tags linked to each object, so
+    that matching all of a set of tags is a merge of the arrays and finding
+    the remaining tags on the matches is a lookup of each. An array holds
+    each id in 8 bytes, where a set would take several times as many.
+    """
+
+    def __init__(self):
+        self.objects = dict((obj_type, {}) for obj_type in OBJECT_TYPES)
+        self.tags = dict((obj_type, {}) for obj_type in OBJECT_TYPES)
+        # Number of links of each (object id, tag id) beyond the first, as
+        # different users may link the same tag to the same object
+        self.duplicates = dict((obj_type, {}) for obj_type in OBJECT_TYPES)
+        # Held while reading the arrays or replacing them once the links are
+        # in use. The arrays are never changed in place.
+        self.lock = threading.Lock()
+        # Held while changes are being made, so only one is made at a time
+        self.write_lock = threading.Lock()
+
+    def extend(self, obj_type, links):
+        """
+        Add links of obj_type while they are being loaded, before sort
+
+        @param links:       Iterable of (object id, tag id)
+        """
+
+        objects = self.objects[obj_type]
+        tags = self.tags[obj_type]
+        for obj_id, tag_id in links:
+            objects.setdefault(tag_id, array("q")).append(obj_id)
+            tags.setdefault(obj_id, array("q")).append(tag_id)
+
+    def sort(self, obj_type):
+        """
+        Sort the arrays of obj_type once all its links have been loaded
+        """
+
+        objects = self.objects[obj_type]
+        tags = self.tags[obj_type]
+        # Different users may link the same tag to the same object, which is
+        # held once, counting the other links so that removing one does not
+        # remove the object from the tag
+        duplicates = self.duplicates[obj_type]
+        for tag_id, ids in objects.items():
+            unique = sorted(set(ids))
+            if len(unique) != len(ids):
+                for obj_id, n in Counter(ids).items():
+                    if n > 1:
+                        duplicates[(obj_id, tag_id)] = n - 1
+            objects[tag_id] = array("q", unique)
+        for obj_id, ids in tags.items():
+            tags[obj_id] = array("q", sorted(set(ids)))
+
+    def apply(self, obj_type, added, removed, replay=False):
+        """
+        Apply changes to the links of obj_type
+
+        The new arrays of each tag and object changed are built from the
+        current ones without holding the lock, so searches are only held up
+        while they replace them.
+
+        @param added:       List of (object id, tag id) of links created
+        @param removed:     List of (object id, tag id) of links deleted
+        @param replay:      Whether the changes were made while the index was
+                            loaded, so that links added may have been loaded
+                            already and are not counted again
+        """
+
+        with self.write_lock:
+            objects = self.objects[obj_type]
+            tags = self.tags[obj_type]
+            duplicates = self.duplicates[obj_type]
+
+            # Whether each pair changed was linked, and is once all the
+            # changes are made
+            was_linked = {}
+            linked = {}
+
+            def is_linked(pair):
+                if pair not in linked:
+                    obj_id, tag_id = pair
+                    was_linked[pair] = _contains(objects.get(tag_id, ()), obj_id)
+                    linked[pair] = was_linked[pair]
+                return linked[pair]
+
+            # Links are created before any are deleted
+            for pair in added:
+                if is_linked(pair):
+                    if not replay:
+                        duplicates[pair] = duplicates.get(pair, 0) + 1
+                else:
+                    linked[pair] = True
+            for pair in removed:
+                if duplicates.get(pair):
+                    duplicates[pair] -= 1
+                    if not duplicates[pair]:
+                        del duplicates[pair]
+                elif is_linked(pair):
+                    linked[pair] = False
+
+            object_changes = {}
+            tag_changes = {}
+            for (obj_id, tag_id), link in linked.items():
+                if link != was_linked[(obj_id, tag_id)]:
+                    object_changes.setdefault(tag_id, []).append((obj_id, link))
+                    tag_changes.setdefault(obj_id, []).append((tag_id, link))
+
+            new_objects = dict(
+                (tag_id, _merge(objects.get(tag_id, array("q")), sorted(changes)))
+                for tag_id, changes in object_changes.items()
+            )
+            new_tags = dict(
+                (obj_id, _merge(tags.get(obj_id, array("q")), sorted(changes)))
+                for obj_id, changes in tag_changes.items()
+            )
+
+            with self.lock:
+                for ids_by_key, new in ((objects, new_objects), (tags, new_tags)):
+                    for key, ids in new.items():
+                        if ids:
+                            ids_by_key[key] = ids
+                        else:
+                            ids_by_key.pop(key, None)
+
+    def match(self, obj_type, tag_ids):
+        """
+        Get the ids of the objects of obj_type linked to all of tag_ids
+        """
+
+        with self.lock:
+            objects = self.objects[obj_type]
+            arrays = [objects.get(tag_id, array("q")) for tag_id in set(tag_ids)]
+            if not arrays:
+                return []
+
+            # Intersect starting from the shortest array
+            arrays.sort(key=len)
+            matches = arrays[0]
+            for ids in arrays[1:]:
+                if not matches:
+                    break
+                matches = intersect(matches, ids)
+            return list(matches)
+
+    def match_any(self, obj_type, tag_ids):
+        """
+        Get the set of ids of the objects of obj_type linked to any of tag_ids
+        """
+
+        with self.lock:
+            objects = self.objects[obj_type]
+            matches = set()
+            for tag_id in tag_ids:
+                matches.update(objects.get(tag_id, ()))
+        return matches
+
+    def counts(self, obj_type):
+        """
+        Get the number of objects of obj_type linked to each tag
+        """
+
+        with self.lock:
+            return dict(
+                (tag_id, len(objects))
+                for tag_id, objects in self.objects[obj_type].items()
+            )
+
+    def remaining(self, obj_type, obj_ids):
+        """
+        Get the ids of the tags linked to any of obj_ids
+
+        @return:            Dict of tag id -> number of obj_ids linked to it
+        """
+
+        with self.lock:
+            tags = self.tags[obj_type]
+            remaining = {}
+            for obj_id in obj_ids:
+                for tag_id in tags.get(obj_id, ()):
+                    remaining[tag_id] = remaining.get(tag_id, 0) + 1
+        return remaining
@@ -0,0 +1,91 @@
+from builtins import object
+
+
+class TagQuery(object):
+    """
+    A boolean tag query: objects with all of all_tags, at least one of
+    any_tags and none of none_tags
+    """
+
+    def __init__(self, all_tags=(), any_tags=(), none_tags=()):
+        self.all_tags = sorted(set(all_tags))
+        self.any_tags = sorted(set(any_tags))
+        self.none_tags = sorted(set(none_tags))
+
+    def is_conjunctive(self):
+        """
+        Whether this is just "has all the tags", the query before OR and NOT
+        """
+
+        return not self.any_tags and not self.none_tags
+
+    def is_valid(self):
+        # Something must be required, as matching everything without some
+        # tags would mean scanning every object
+        return bool(self.all_tags or self.any_tags)
+
+
+def plan(query, counts):
+    """
+    Order the terms of a query so that the most selective are evaluated first
+
+    The counts are only estimates (they may be cached), so a term estimated
+    to match nothing is evaluated first rather than trusted
+
+    @param counts:          Dict of tag id -> number of objects linked to it
+    @return:                List of (operator, tag ids) where operator is one
+                            of "all", "any" or "none"
+    """
+
+    steps = []
+    for tag_id in query.all_tags:
+        steps.append((counts.get(tag_id, 0), "all", [tag_id]))
+    if query.any_tags:
+        # At most the sum of the tags' objects
+        steps.append(
+            (sum(counts.get(t, 0) for t in query.any_tags), "any", query.any_tags)
+        )
+
+    steps.sort(key=lambda step: step[0])
+    plan = [(operator, tag_ids) for estimate, operator, tag_ids in steps]
+
+    # Exclusions only ever remove from the matches, so they come last
+    if query.none_tags:
+        plan.append(("none", query.none_tags))
+    return plan
+
+
+def evaluate(steps, fetch):
+    """
+    Evaluate planned steps, stopping as soon as nothing matches
+
+    @param fetch:           Function of (tag ids, candidates) returning the
+                            set of objects linked to any of the tag ids,
+                            restricted to candidates unless it is None
+    @return:                Sorted list of matching object ids
+    """
+
+    matches = None
+    for operator, tag_ids in steps:
+        found = fetch(tag_ids, matches)
+        if operator == "none":
+            matches = matches - found
+        else:
+            matches = found if matches is None else matches & found
+        if not matches:
+            return []
+    return sorted(matches)
+
+
+def index_fetcher(index, obj_type):
+    """
+    Get a fetch function for evaluate which uses a TagLinkIndex
+    """
+
+    def fetch(tag_ids, candidates):
+        found = index.match_any(obj_type, tag_ids)
+        if candidates is not None:
+            found &= candidates
+        return found
+
+    return fetch
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+from omeroweb.settings import parse_boolean, process_custom_settings, report_settings
+
+# Settings can be changed with e.g.
+# omero config set omero.web.tagsearch.query_batch_size 500
+TAGSEARCH_SETTINGS_MAPPINGS = {
+    "omero.web.tagsearch.query_batch_size": [
+        "QUERY_BATCH_SIZE",
+        1000,
+        int,
+        "Maximum number of ids bound to a single IN list in a query.",
+    ],
+    "omero.web.tagsearch.query_workers": [
+        "QUERY_WORKERS",
+        4,
+        int,
+        "Number of threads used to run batches of a query concurrently.",
+    ],
+    "omero.web.tagsearch.remaining_query": [
+        "REMAINING_QUERY",
+        "ids",
+        str,
+        (
+            "How the remaining tags are found after matching. 'ids' passes "
+            "the matched ids back to the server, 'subquery' matches again in "
+            "a subquery which avoids transferring large numbers of ids."
+        ),
+    ],
+    "omero.web.tagsearch.index": [
+        "INDEX",
+        "false",
+        parse_boolean,
+        (
+            "Whether to search an in-memory index of each group's tag links, "
+            "built on the first search, instead of querying the server."
+        ),
+    ],
+    "omero.web.tagsearch.index_ttl": [
+        "INDEX_TTL",
+        600,
+        int,
+        "Seconds after which the in-memory tag link index is rebuilt.",
+    ],
+    "omero.web.tagsearch.preview_page_size": [
+        "PREVIEW_PAGE_SIZE",
+        200,
+        int,
+        "Number of results of each type shown per page of the preview.",
+    ],
+    "omero.web.tagsearch.autocomplete": [
+        "AUTOCOMPLETE",
+        "false",
+        parse_boolean,
+        (
+            "Whether to load tags into the tag selector as they are typed "
+            "instead of loading every applied tag with the page."
+        ),
+    ],
+    "omero.web.tagsearch.tag_cache_ttl": [
+        "TAG_CACHE_TTL",
+        300,
+        int,
+        "Seconds to cache the applied tags of a group for. 0 disables the cache.",
+    ],
+    "omero.web.tagsearch.group_cache_ttl": [
+        "GROUP_CACHE_TTL",
+        60,
+        int,
+        (
+            "Seconds to cache the groups and their members shown on the tag "
+            "search page for each session. 0 disables the cache."
+        ),
+    ],
+    "omero.web.tagsearch.result_cache_size": [
+        "RESULT_CACHE_SIZE",
+        256,
+        int,
+        (
+            "Number of searches whose results are cached by each OMERO.web "
+            "process. 0 disables the cache."
+        ),
+    ],
+    "omero.web.tagsearch.result_cache_ttl": [
+        "RESULT_CACHE_TTL",
+        300,
+        int,
+        "Seconds to cache the results of a search for.",
+    ],
+    "omero.web.tagsearch.metrics": [
+        "METRICS",
+        "false",
+        parse_boolean,
+        (
+            "Whether to serve query and request timings for Prometheus at "
+            "tagsearch/metrics."
+        ),
+    ],
+}
+
+process_custom_settings(sys.modules[__name__], "TAGSEARCH_SETTINGS_MAPPINGS")
+report_settings(sys.modules[__name__])
@@ -0,0 +1,201 @@
+from builtins import object
+import functools
+import re
+import threading
+import time
+from django.http import Http404, HttpResponse
+from . import tagsearch_settings
+
+# Prefix of the names of the metrics of this app
+METRICS_PREFIX = "omero_webtagging_tagsearch"
+
+# The first entity queried from, used as the object type of a query
+_FROM = re.compile(r"\bfrom\s+(\w+)", re.IGNORECASE)
+
+# Totals since the process started, (query, object type) -> [count, seconds,
+# rows] and view -> [count, seconds]
+_queries = {}
+_views = {}
+_lock = threading.Lock()
+
+# The timings of the request being handled by this thread, if any
+_request = threading.local()
+
+
+class RequestTimings(object):
+    """
+    The queries run while handling a request
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def add(self, name, obj_type, seconds, rows):
+        with self.lock:
+            self.queries.append((name, obj_type, seconds, rows))
+
+    def header(self):
+        """
+        Get the Server-Timing header value, with the total duration of each
+        named query
+        """
+
+        totals = {}
+        with self.lock:
+            for name, obj_type, seconds, rows in self.queries:
+                total = totals.setdefault(name, [0, 0.0, 0])
+                total[0] += 1
+                total[1] += seconds
+                total[2] += rows
+        return ", ".join(
+            '%s;dur=%.1f;desc="%s queries, %s rows"'
+            % (name, total[1] * 1000, total[0], total[2])
+            for name, total in sorted(totals.items())
+        )
+
+
+def _object_type(hql):
+    match = _FROM.search(hql)
+    return match.group(1) if match else ""
+
+
+def record(name, obj_type, seconds, rows, timings=None):
+    """
+    Record a query in the process totals and the timings of a request
+    """
+
+    with _lock:
+        total = _queries.setdefault((name, obj_type), [0, 0.0, 0])
+        total[0] += 1
+        total[1] += seconds
+        total[2] += rows
+    if timings is not None:
+        timings.add(name, obj_type, seconds, rows)
+
+
+class TimedQueryService(object):
+    """
+    Query service which records the duration and number of rows of each query
+
+    The timings of the request are those of the thread which created this, so
+    that queries run by it on other threads are still recorded against the
+    request.
+    """
+
+    def __init__(self, qs, name):
+        self._qs = qs
+        self._name = name
+        self._timings = getattr(_request, "timings", None)
+
+    def _timed(self, method, hql, *args):
+        start = time.time()
+        rows = method(hql, *args)
+        record(
+            self._name,
+            _object_type(hql),
+            time.time() - start,
+            len(rows),
+            self._timings,
+        )
+        return rows
+
+    def projection(self, hql, *args):
+        return self._timed(self._qs.projection, hql, *args)
+
+    def findAllByQuery(self, hql, *args):
+        return self._timed(self._qs.findAllByQuery, hql, *args)
+
+    def __getattr__(self, attr):
+        return getattr(self._qs, attr)
+
+
+def timed_query_service(conn, name):
+    """
+    Get the query service of a connection, timing queries under name
+    """
+
+    return TimedQueryService(conn.getQueryService(), name)
+
+
+def server_timing(view):
+    """
+    Decorator recording the duration of a view and adding a Server-Timing
+    header with the queries it ran
+
+    Queries run while a streaming response is consumed are only recorded in
+    the process totals.
+    """
+
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        _request.timings = timings = RequestTimings()
+        start = time.time()
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            del _request.timings
+        seconds = time.time() - start
+
+        with _lock:
+            total = _views.setdefault(view.__name__, [0, 0.0])
+            total[0] += 1
+            total[1] += seconds
+        header = timings.header()
+        response["Server-Timing"] = ", ".join(
+            h for h in (header, "total;dur=%.1f" % (seconds * 1000)) if h
+        )
+        return response
+
+    return wrapped
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def render_metrics():
+    """
+    Get the process totals in the Prometheus text format
+    """
+
+    with _lock:
+        queries = sorted((k, list(v)) for k, v in _queries.items())
+        views = sorted((k, list(v)) for k, v in _views.items())
+
+    lines = [
+        "# HELP %s_query_seconds Time spent running HQL queries" % METRICS_PREFIX,
+        "# TYPE %s_query_seconds summary" % METRICS_PREFIX,
+    ]
+    for (name, obj_type), (count, seconds, rows) in queries:
+        labels = 'query="%s",type="%s"' % (_label(name), _label(obj_type))
+        lines.append("%s_query_seconds_count{%s} %s" % (METRICS_PREFIX, labels, count))
+        lines.append("%s_query_seconds_sum{%s} %s" % (METRICS_PREFIX, labels, seconds))
+    lines += [
+        "# HELP %s_query_rows_total Rows returned by HQL queries" % METRICS_PREFIX,
+        "# TYPE %s_query_rows_total counter" % METRICS_PREFIX,
+    ]
+    for (name, obj_type), (count, seconds, rows) in queries:
+        labels = 'query="%s",type="%s"' % (_label(name), _label(obj_type))
+        lines.append("%s_query_rows_total{%s} %s" % (METRICS_PREFIX, labels, rows))
+    lines += [
+        "# HELP %s_view_seconds Time spent handling requests" % METRICS_PREFIX,
+        "# TYPE %s_view_seconds summary" % METRICS_PREFIX,
+    ]
+    for name, (count, seconds) in views:
+        labels = 'view="%s"' % _label(name)
+        lines.append("%s_view_seconds_count{%s} %s" % (METRICS_PREFIX, labels, count))
+        lines.append("%s_view_seconds_sum{%s} %s" % (METRICS_PREFIX, labels, seconds))
+    return "\n".join(lines) + "\n"
+
+
+def metrics(request):
+    """
+    Serve the process totals for Prometheus, if enabled with METRICS
+    """
+
+    if not tagsearch_settings.METRICS:
+        raise Http404("Metrics are not enabled")
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
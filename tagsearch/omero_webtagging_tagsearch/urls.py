@@ -1,9 +1,13 @@
 from django.conf.urls import url
-from . import views
+from . import timing, views
 
 urlpatterns = [
     # index 'home page' of the webtagging app
     url(r"^$", views.index, name="tagsearch"),
     # index 'home page' of the webtagging app
     url(r"^images$", views.tag_image_search, name="wtsimages"),
+    # autocomplete of applied tags
+    url(r"^tags/autocomplete$", views.tag_autocomplete, name="wtstags_autocomplete"),
+    # query and request timings for Prometheus
+    url(r"^metrics$", timing.metrics, name="wtsmetrics"),
 ]
@@ -0,0 +1,150 @@
+from builtins import range
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from django.core.cache import cache
+import omero
+from . import tagsearch_settings
+
+
+def batches(items, size):
+    """
+    Split a list into consecutive batches of at most size items
+    """
+
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Get the thread pool shared by concurrent queries, creating it if necessary
+    """
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=tagsearch_settings.QUERY_WORKERS)
+        return _executor
+
+
+def chunked_projection(qs, q, ids, service_opts, name="oids", params=None, key=None):
+    """
+    Run a projection which has a large IN list of ids in batches
+
+    The ids are bound in batches of at most QUERY_BATCH_SIZE and the batches
+    are run concurrently. If key is specified, all the results are sorted by
+    it, otherwise they are concatenated in batch order. The ORDER BY of the
+    query only orders each batch, and the database may collate differently
+    from key, so the results are sorted even if there is only one batch, to
+    keep their order the same whatever the batch size.
+
+    @param qs:              The query service
+    @param q:               The HQL query
+    @param ids:             The ids to bind
+    @param service_opts:    The service options to run the query with
+    @param name:            The name of the parameter to bind the ids to
+    @param params:          Parameters for any other placeholders in q
+    @param key:             Function giving the sort key of a result row
+    """
+
+    def run(batch):
+        p = omero.sys.ParametersI(dict(params.map) if params else None)
+        p.addLongs(name, batch)
+        return qs.projection(q, p, service_opts)
+
+    ids = list(ids)
+    chunks = list(batches(ids, tagsearch_settings.QUERY_BATCH_SIZE))
+
+    # Avoid the thread pool when there is nothing to parallelize
+    if len(chunks) <= 1:
+        results = [run(chunks[0])] if chunks else []
+    else:
+        results = list(get_executor().map(run, chunks))
+
+    rows = [row for result in results for row in result]
+    if key is not None:
+        rows.sort(key=key)
+    return rows
+
+
+# Seconds for which whether a group is readable by its members is cached
+GROUP_READ_TTL = 60
+
+# Group id -> (time checked, whether the group is readable by its members)
+_group_read = {}
+_group_read_lock = threading.Lock()
+
+
+def is_group_read(conn, group_id):
+    """
+    Get whether a group is readable by its members
+
+    This is cached for GROUP_READ_TTL seconds, as it is needed by every
+    search and rarely changes
+    """
+
+    now = time.time()
+    with _group_read_lock:
+        cached = _group_read.get(group_id)
+    if cached is not None and cached[0] >= now - GROUP_READ_TTL:
+        return cached[1]
+
+    group = conn.getObject("ExperimenterGroup", group_id)
+    if group is None:
+        return False
+    readable = group.getDetails().getPermissions().isGroupRead()
+    with _group_read_lock:
+        _group_read[group_id] = (now, readable)
+    return readable
+
+
+def _generation_key(group_id):
+    return "omero_webtagging_tagsearch:tags:%s:generation" % group_id
+
+
+def tag_links_generation(group_id):
+    """
+    Get the generation of the tag links of a group
+
+    This is kept in the Django cache and incremented whenever autotag changes
+    the tag links of the group, so that what is derived from them can be
+    invalidated by every process and not just the one which changed them
+    """
+
+    return cache.get(_generation_key(group_id), 0)
+
+
+def invalidate_tag_links(group_id):
+    """
+    Start a new generation of the tag links of a group
+
+    @return:                The new generation
+    """
+
+    key = _generation_key(group_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Does not exist yet, so start a new generation
+        cache.set(key, 1, None)
+        return 1
+
+
+def visibility_key(conn, group_id):
+    """
+    Get the key under which data visible in a group can be shared
+
+    Members of a group which is readable by its members can all see the same
+    data, so this is just the group. Otherwise what each member can see
+    differs, so it is the group and the user.
+    """
+
+    group_id = int(group_id)
+    if is_group_read(conn, group_id):
+        return (group_id, None)
+    return (group_id, conn.getUserId())
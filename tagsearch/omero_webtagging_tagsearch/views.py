@@ -1,20 +1,53 @@
 from __future__ import absolute_import
-from builtins import str
+from builtins import str, zip
 import json
 import logging
-from django.http import HttpResponse, HttpResponseRedirect
+from datetime import datetime
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    JsonResponse,
+)
 from django.urls import reverse
 from django.template.loader import render_to_string
 from omeroweb.webclient.decorators import render_response, login_required
+import omero
 from omero.sys import Parameters
-from omero.rtypes import rlong, rlist
+from omero.rtypes import rlong, rlist, unwrap
 from omeroweb.webclient.views import switch_active_group
 from omeroweb.webclient.forms import GlobalSearchForm, ContainerForm
+from omeroweb.webclient.tree import parse_permissions_css
+from omero.gateway import ExperimenterGroupWrapper
+from . import tagsearch_settings, tag_index
+from .result_cache import result_cache
+from .tag_index import OBJECT_TYPES
+from .applied_tags import get_applied_tags, search_tags
 from .forms import TagSearchForm
+from .groups import get_groups, query_groups, summarise_group
+from .planner import get_tag_counts, query_fetcher
+from .tag_query import TagQuery, evaluate, index_fetcher, plan
+from .timing import server_timing, timed_query_service
+from .utils import chunked_projection, get_executor, tag_links_generation
 
 logger = logging.getLogger(__name__)
 
+# The keys of the object types in the preview's manager.containers
+CONTAINER_KEYS = {
+    "Image": "image",
+    "Dataset": "dataset",
+    "Project": "project",
+    "Screen": "screen",
+    "Plate": "plate",
+    "PlateAcquisition": "acquisition",
+}
 
+# Largest number of results of each type which can be requested per page of
+# the preview
+PREVIEW_PAGE_SIZE_MAX = 1000
+
+
+@server_timing
 @login_required()
 @render_response()
 def index(request, conn=None, **kwargs):
@@ -120,10 +153,19 @@ def index(request, conn=None, **kwargs):
 
     # validate experimenter is in the active group
     active_group = request.session.get("active_group") or conn.getEventContext().groupId
+    # All the groups and their members are loaded at once
+    myGroups = get_groups(conn, request.session.session_key)
+    groups_by_id = dict((g.getId(), g) for g in myGroups)
+    active_group_obj = groups_by_id.get(int(active_group))
+    if active_group_obj is None:
+        active_group_obj = summarise_group(
+            conn,
+            ExperimenterGroupWrapper(conn, query_groups(conn, [int(active_group)])[0]),
+        )
+
     # prepare members of group...
-    s = conn.groupSummary(active_group)
-    leaders = s["leaders"]
-    members = s["colleagues"]
+    leaders = active_group_obj.leaders
+    members = active_group_obj.colleagues
     userIds = [u.id for u in leaders]
     userIds.extend([u.id for u in members])
     users = []
@@ -161,56 +203,15 @@ def index(request, conn=None, **kwargs):
 
     request.session["user_id"] = user_id
 
-    if conn.isAdmin():  # Admin can see all groups
-        myGroups = [
-            g
-            for g in conn.getObjects("ExperimenterGroup")
-            if g.getName() not in ("user", "guest")
-        ]
-    else:
-        myGroups = list(conn.getGroupsMemberOf())
-    myGroups.sort(key=lambda x: x.getName().lower())
     new_container_form = ContainerForm()
 
     # Create and set the form
 
-    params = Parameters()
-    qs = conn.getQueryService()
-    service_opts = conn.SERVICE_OPTS.copy()
-    service_opts.setOmeroGroup(active_group)
-
-    def get_tags(obj):
-
-        # Get tags
-        # It is not sufficient to simply get the objects as there may be tags
-        # which are not applied which don't really make sense to display
-        # tags = list(self.conn.getObjects("TagAnnotation"))
-        hql = (
-            """
-            SELECT DISTINCT link.child.id, link.child.textValue
-            FROM %sAnnotationLink link
-            WHERE link.child.class IS TagAnnotation
-            ORDER BY link.child.textValue
-        """
-            % obj
-        )
-
-        return [
-            (result[0].val, result[1].val)
-            for result in qs.projection(hql, params, service_opts)
-        ]
-
-    # List of tuples (id, value)
-    tags = set(get_tags("Image"))
-    tags.update(get_tags("Dataset"))
-    tags.update(get_tags("Project"))
-    tags.update(get_tags("Plate"))
-    tags.update(get_tags("PlateAcquisition"))
-    tags.update(get_tags("Screen"))
-
-    # Convert back to an ordered list and sort
-    tags = list(tags)
-    tags.sort(key=lambda x: x[1].lower())
+    # With autocomplete, tags are loaded as they are searched for instead
+    if tagsearch_settings.AUTOCOMPLETE:
+        tags = []
+    else:
+        tags = get_applied_tags(conn, active_group)
 
     form = TagSearchForm(tags, conn, initial={"results_preview": True})
 
@@ -221,19 +222,83 @@ def index(request, conn=None, **kwargs):
         "global_search_form": global_search_form,
     }
     context["groups"] = myGroups
-    context["active_group"] = conn.getObject("ExperimenterGroup", int(active_group))
-    for g in context["groups"]:
-        g.groupSummary()  # load leaders / members
-    context["active_user"] = conn.getObject("Experimenter", int(user_id))
+    context["active_group"] = active_group_obj
+    # The active user is usually one of the members already loaded
+    active_user = [u for u in leaders + members if u.id == int(user_id)]
+    if active_user:
+        context["active_user"] = active_user[0]
+    else:
+        context["active_user"] = conn.getObject("Experimenter", int(user_id))
 
     context["isLeader"] = conn.isLeader()
     context["current_url"] = url
     context["template"] = template
     context["tagnav_form"] = form
+    context["autocomplete"] = tagsearch_settings.AUTOCOMPLETE
 
     return context
 
 
+def _load_preview(conn, obj_type, ids, service_opts):
+    """
+    Load just what the preview displays of the specified objects, ordered by
+    id
+    """
+
+    hql = (
+        "select new map(obj.id as id, "
+        "obj.name as name, "
+        "obj.details.owner.id as ownerId, "
+        "obj as obj_details_permissions, "
+        "obj.details.creationEvent.time as created, "
+        "obj.details.group.name as groupName) "
+        "from %s obj "
+        "where obj.id in (:oids) "
+        "order by obj.id" % obj_type
+    )
+    params = omero.sys.ParametersI()
+    params.addLongs("oids", ids)
+
+    qs = timed_query_service(conn, "preview")
+    objects = []
+    for e in qs.projection(hql, params, service_opts):
+        e = unwrap(e)[0]
+        objects.append(
+            {
+                "id": e["id"],
+                "name": e["name"] or "",
+                "ownerId": e["ownerId"],
+                "permsCss": parse_permissions_css(
+                    e["obj_details_permissions"], e["ownerId"], conn
+                ),
+                "creationEventDate": datetime.fromtimestamp(e["created"] / 1000),
+                "groupName": e["groupName"],
+            }
+        )
+    return objects
+
+
+@server_timing
+@login_required()
+def tag_autocomplete(request, conn=None, **kwargs):
+    """
+    Get the applied tags of the active group which start with q
+    """
+
+    query = request.GET.get("q", "")
+    try:
+        limit = min(int(request.GET.get("limit", 20)), 100)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid limit")
+
+    active_group = request.session.get("active_group") or conn.getEventContext().groupId
+
+    tags = search_tags(conn, active_group, query, limit)
+
+    return JsonResponse({"tags": [{"id": t[0], "value": t[1]} for t in tags]})
+
+
+@server_timing
 @login_required(setGroupContext=True)
 # TODO Figure out what happened to render_response as it wasn't working on
 # production
@@ -245,6 +310,13 @@ def tag_image_search(request, conn=None, **kwargs):
     if request.method == "POST":
 
         selected_tags = [int(x) for x in request.POST.getlist("selectedTags")]
+        query = TagQuery(
+            selected_tags,
+            [int(x) for x in request.POST.getlist("anyTags")],
+            [int(x) for x in request.POST.getlist("excludedTags")],
+        )
+        if (query.any_tags or query.none_tags) and not query.is_valid():
+            return HttpResponseBadRequest("At least one tag must be required")
         results_preview = bool(request.POST.get("results_preview"))
 
         # validate experimenter is in the active group
@@ -254,6 +326,9 @@ def tag_image_search(request, conn=None, **kwargs):
         service_opts = conn.SERVICE_OPTS.copy()
         service_opts.setOmeroGroup(active_group)
 
+        # Created here as the matches may be queried on other threads
+        match_qs = timed_query_service(conn, "match")
+
         def getObjectsWithAllAnnotations(obj_type, annids):
             # Get the images that match
             hql = (
@@ -266,12 +341,13 @@ def tag_image_search(request, conn=None, **kwargs):
             params.map = {}
             params.map["oids"] = rlist([rlong(o) for o in set(annids)])
 
-            qs = conn.getQueryService()
-            return [x[0].getValue() for x in qs.projection(hql, params, service_opts)]
+            rows = match_qs.projection(hql, params, service_opts)
+            return [x[0].getValue() for x in rows]
 
         context = {}
         html_response = ""
         remaining = set([])
+        navcounts = {}
 
         manager = {"containers": {}}
         preview = False
@@ -282,59 +358,106 @@ def tag_image_search(request, conn=None, **kwargs):
         acquisition_count = 0
         image_count = 0
 
-        if selected_tags:
-            image_ids = getObjectsWithAllAnnotations("Image", selected_tags)
+        if query.is_valid():
+            timings = {}
+
+            def match(obj_type):
+                type_start = time.time()
+                ids = getObjectsWithAllAnnotations(obj_type, selected_tags)
+                timings[obj_type] = time.time() - type_start
+                return ids
+
+            # Repeated searches reuse the matches and remaining tags, until
+            # the tag links of the group change
+            cache_key = (
+                int(active_group),
+                tag_links_generation(int(active_group)),
+                conn.getUserId(),
+                tuple(query.all_tags),
+                tuple(query.any_tags),
+                tuple(query.none_tags),
+                results_preview,
+            )
+            cached = result_cache.get(cache_key)
+
+            if cached is not None:
+                matched, navcounts = cached
+            elif not query.is_conjunctive():
+                # OR and NOT are evaluated term by term, most selective first
+                if tagsearch_settings.INDEX:
+                    index = tag_index.get_index(conn, active_group)
+                else:
+                    counts = get_tag_counts(conn, active_group)
+                matched = {}
+                for obj_type in OBJECT_TYPES:
+                    type_start = time.time()
+                    if tagsearch_settings.INDEX:
+                        steps = plan(query, index.counts(obj_type))
+                        fetch = index_fetcher(index, obj_type)
+                    else:
+                        steps = plan(query, counts[obj_type])
+                        fetch = query_fetcher(conn, obj_type, service_opts)
+                    matched[obj_type] = evaluate(steps, fetch)
+                    timings[obj_type] = time.time() - type_start
+            elif tagsearch_settings.INDEX:
+                index = tag_index.get_index(conn, active_group)
+                matched = {}
+                for obj_type in OBJECT_TYPES:
+                    type_start = time.time()
+                    matched[obj_type] = index.match(obj_type, selected_tags)
+                    timings[obj_type] = time.time() - type_start
+            else:
+                # The object types are independent, so query them concurrently
+                matched = dict(
+                    zip(OBJECT_TYPES, get_executor().map(match, OBJECT_TYPES))
+                )
+
+            image_ids = matched["Image"]
             context["image_count"] = len(image_ids)
             image_count = len(image_ids)
 
-            dataset_ids = getObjectsWithAllAnnotations("Dataset", selected_tags)
+            dataset_ids = matched["Dataset"]
             context["dataset_count"] = len(dataset_ids)
             dataset_count = len(dataset_ids)
 
-            project_ids = getObjectsWithAllAnnotations("Project", selected_tags)
+            project_ids = matched["Project"]
             context["project_count"] = len(project_ids)
             project_count = len(project_ids)
 
-            screen_ids = getObjectsWithAllAnnotations("Screen", selected_tags)
+            screen_ids = matched["Screen"]
             context["screen_count"] = len(screen_ids)
             screen_count = len(screen_ids)
 
-            plate_ids = getObjectsWithAllAnnotations("Plate", selected_tags)
+            plate_ids = matched["Plate"]
             context["plate_count"] = len(plate_ids)
             plate_count = len(plate_ids)
 
-            acquisition_ids = getObjectsWithAllAnnotations(
-                "PlateAcquisition", selected_tags
-            )
+            acquisition_ids = matched["PlateAcquisition"]
             context["acquisition_count"] = len(acquisition_ids)
             acquisition_count = len(acquisition_ids)
 
             if results_preview:
-                if image_ids:
-                    images = conn.getObjects("Image", ids=image_ids)
-                    manager["containers"]["image"] = list(images)
-
-                if dataset_ids:
-                    datasets = conn.getObjects("Dataset", ids=dataset_ids)
-                    manager["containers"]["dataset"] = list(datasets)
-
-                if project_ids:
-                    projects = conn.getObjects("Project", ids=project_ids)
-                    manager["containers"]["project"] = list(projects)
-
-                if screen_ids:
-                    screens = conn.getObjects("Screen", ids=screen_ids)
-                    manager["containers"]["screen"] = list(screens)
-
-                if plate_ids:
-                    plates = conn.getObjects("Plate", ids=plate_ids)
-                    manager["containers"]["plate"] = list(plates)
-
-                if acquisition_ids:
-                    acquisitions = conn.getObjects(
-                        "PlateAcquisition", ids=acquisition_ids
+                # Only the requested page of each type is loaded
+                try:
+                    offset = max(int(request.POST.get("offset", 0)), 0)
+                    limit = int(
+                        request.POST.get("limit", tagsearch_settings.PREVIEW_PAGE_SIZE)
                     )
-                    manager["containers"]["acquisition"] = list(acquisitions)
+                except ValueError:
+                    return HttpResponseBadRequest("Invalid offset or limit")
+                limit = min(max(limit, 1), PREVIEW_PAGE_SIZE_MAX)
+                manager["offset"] = offset
+                manager["limit"] = limit
+                manager["previous_offset"] = max(offset - limit, 0)
+                if any(len(ids) > offset + limit for ids in matched.values()):
+                    manager["next_offset"] = offset + limit
+
+                for obj_type in OBJECT_TYPES:
+                    page_ids = sorted(matched[obj_type])[offset : offset + limit]
+                    if page_ids:
+                        manager["containers"][CONTAINER_KEYS[obj_type]] = _load_preview(
+                            conn, obj_type, page_ids, service_opts
+                        )
 
                 manager["c_size"] = (
                     len(image_ids)
@@ -355,56 +478,83 @@ def tag_image_search(request, conn=None, **kwargs):
 
             middle = time.time()
 
+            remaining_qs = timed_query_service(conn, "remaining")
+
             def getAnnotationsForObjects(obj_type, oids):
-                # Get the images that match
+                # Get the tags on the matches and how many of them have each
                 hql = (
-                    "select distinct link.child.id from %sAnnotationLink link "
-                    "where link.parent.id in (:oids)" % obj_type
+                    "select link.child.id, count(distinct link.parent.id) "
+                    "from %sAnnotationLink link "
+                    "where link.parent.id in (:oids) "
+                    "group by link.child.id" % obj_type
                 )
 
+                # Large numbers of matches are queried in batches. The
+                # batches have no matches in common, so their counts add up
+                counts = {}
+                for result in chunked_projection(remaining_qs, hql, oids, service_opts):
+                    tag_id = result[0].val
+                    counts[tag_id] = counts.get(tag_id, 0) + result[1].val
+                return counts
+
+            def getAnnotationsForMatches(obj_type, annids):
+                # Match and get the tags on the matches in one query, so
+                # that the matched ids do not have to be passed back in
+                hql = (
+                    "select link.child.id, count(distinct link.parent.id) "
+                    "from %sAnnotationLink link "
+                    "where link.parent.id in ("
+                    "select sublink.parent.id from %sAnnotationLink sublink "
+                    "where sublink.child.id in (:oids) "
+                    "group by sublink.parent.id "
+                    "having count (distinct sublink.child) = %s) "
+                    "group by link.child.id" % (obj_type, obj_type, len(set(annids)))
+                )
                 params = Parameters()
                 params.map = {}
-                params.map["oids"] = rlist([rlong(o) for o in oids])
-
-                qs = conn.getQueryService()
-                return [
-                    result[0].val for result in qs.projection(hql, params, service_opts)
-                ]
-
-            # Calculate remaining possible tag navigations
-            # TODO Compare subquery to pass-in performance
-            # sub_hql = """
-            #     SELECT link.parent.id
-            #     FROM ImageAnnotationLink link
-            #     WHERE link.child.id IN (:oids)
-            #     GROUP BY link.parent.id
-            #     HAVING count (link.parent) = %s
-            # """ % len(selected_tags)
-            # hql = """
-            #     SELECT DISTINCT link.child.id
-            #     FROM ImageAnnotationLink link
-            #     WHERE link.parent.id IN (%s)
-            # """ % sub_hql
-
-            if image_ids:
-                remaining.update(getAnnotationsForObjects("Image", image_ids))
-            if dataset_ids:
-                remaining.update(getAnnotationsForObjects("Dataset", dataset_ids))
-            if project_ids:
-                remaining.update(getAnnotationsForObjects("Project", project_ids))
-            if acquisition_ids:
-                remaining.update(
-                    getAnnotationsForObjects("PlateAcquisition", acquisition_ids)
+                params.map["oids"] = rlist([rlong(o) for o in set(annids)])
+
+                return dict(
+                    (result[0].val, result[1].val)
+                    for result in remaining_qs.projection(hql, params, service_opts)
                 )
-            if plate_ids:
-                remaining.update(getAnnotationsForObjects("Plate", plate_ids))
-            if screen_ids:
-                remaining.update(getAnnotationsForObjects("Screen", screen_ids))
+
+            # Calculate remaining possible tag navigations, with the number
+            # of matches of each type that would remain for each of them
+            remaining_query = tagsearch_settings.REMAINING_QUERY
+            if tagsearch_settings.INDEX:
+                remaining_query = "index"
+            elif not query.is_conjunctive():
+                # The subquery can only match all of the selected tags
+                remaining_query = "ids"
+            if cached is None:
+                for obj_type in OBJECT_TYPES:
+                    if not matched[obj_type]:
+                        continue
+                    if remaining_query == "index":
+                        counts = index.remaining(obj_type, matched[obj_type])
+                    elif remaining_query == "subquery":
+                        counts = getAnnotationsForMatches(obj_type, selected_tags)
+                    else:
+                        counts = getAnnotationsForObjects(obj_type, matched[obj_type])
+                    for tag_id, count in counts.items():
+                        navcounts.setdefault(tag_id, {})[obj_type] = count
+                result_cache.put(cache_key, (matched, navcounts))
+            remaining.update(navcounts)
 
             end = time.time()
             logger.info(
-                "Tag Query Times. Preview: %ss, Remaining: %ss, Total:%ss"
-                % ((middle - start), (end - middle), (end - start))
+                "Tag Query Times. Preview: %ss, Remaining (%s): %ss, Total:%ss"
+                % ((middle - start), remaining_query, (end - middle), (end - start))
+            )
+            if cached is None:
+                logger.info(
+                    "Tag Match Times. %s"
+                    % ", ".join("%s: %ss" % (t, timings[t]) for t in OBJECT_TYPES)
+                )
+            stats = sorted(result_cache.stats().items())
+            logger.info(
+                "Tag Result Cache. %s" % ", ".join("%s: %s" % kv for kv in stats)
             )
 
         # Return the navigation data and the html preview for display
@@ -413,6 +563,7 @@ def tag_image_search(request, conn=None, **kwargs):
             json.dumps(
                 {
                     "navdata": list(remaining),
+                    "navcounts": navcounts,
                     "preview": preview,
                     "project_count": project_count,
                     "dataset_count": dataset_count,
@@ -0,0 +1,56 @@
+"""
+The cache of search results
+"""
+
+import time
+
+from omero_webtagging_tagsearch.lru_cache import ResultCache
+
+
+def test_get_and_put():
+    cache = ResultCache(10, 60)
+    assert cache.get((1, "a")) is None
+    cache.put((1, "a"), [1, 2])
+    assert cache.get((1, "a")) == [1, 2]
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1, "capacity": 10}
+
+
+def test_least_recently_used_dropped():
+    cache = ResultCache(2, 60)
+    cache.put((1, "a"), "a")
+    cache.put((1, "b"), "b")
+    cache.get((1, "a"))
+    cache.put((1, "c"), "c")
+    assert cache.get((1, "b")) is None
+    assert cache.get((1, "a")) == "a"
+    assert cache.get((1, "c")) == "c"
+
+
+def test_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache = ResultCache(10, 60)
+    cache.put((1, "a"), "a")
+    now[0] += 60
+    assert cache.get((1, "a")) == "a"
+    now[0] += 1
+    assert cache.get((1, "a")) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_invalidate_group():
+    cache = ResultCache(10, 60)
+    cache.put((1, "a"), "a")
+    cache.put((1, "b"), "b")
+    cache.put((2, "a"), "c")
+    cache.invalidate_group(1)
+    assert cache.get((1, "a")) is None
+    assert cache.get((1, "b")) is None
+    assert cache.get((2, "a")) == "c"
+
+
+def test_disabled():
+    cache = ResultCache(0, 60)
+    cache.put((1, "a"), "a")
+    assert cache.get((1, "a")) is None
+    assert cache.stats()["size"] == 0
@@ -0,0 +1,123 @@
+"""
+The sorted arrays of tag links which the tag link index is made of
+"""
+
+from array import array
+import random
+
+from omero_webtagging_tagsearch.tag_links import TagLinks, _merge, intersect
+
+
+def links(pairs):
+    tag_links = TagLinks()
+    tag_links.extend("Image", pairs)
+    tag_links.sort("Image")
+    return tag_links
+
+
+def test_intersect_matches_sets():
+    r = random.Random(1)
+    for _ in range(500):
+        a = sorted(r.sample(range(200), r.randrange(100)))
+        b = sorted(r.sample(range(200), r.randrange(200)))
+        result = intersect(array("q", a), array("q", b))
+        assert list(result) == sorted(set(a) & set(b))
+
+
+def test_intersect_much_shorter():
+    # Looked up by bisection rather than merged
+    a = array("q", [3, 500, 999, 5000])
+    b = array("q", range(0, 1000, 3))
+    assert list(intersect(a, b)) == [3, 999]
+    assert list(intersect(b, a)) == [3, 999]
+    assert list(intersect(array("q"), b)) == []
+
+
+def test_merge():
+    ids = array("q", [2, 4, 6, 8])
+    changes = [(1, True), (4, False), (5, True), (8, False), (9, True)]
+    assert list(_merge(ids, changes)) == [1, 2, 5, 6, 9]
+    # The array merged into is not changed
+    assert list(ids) == [2, 4, 6, 8]
+
+
+def test_sort_dedups_and_counts_duplicates():
+    tag_links = links([(3, 1), (2, 1), (3, 1), (3, 1), (2, 5)])
+    assert list(tag_links.objects["Image"][1]) == [2, 3]
+    assert list(tag_links.tags["Image"][3]) == [1]
+    assert tag_links.duplicates["Image"] == {(3, 1): 2}
+
+
+def test_match_and_remaining():
+    tag_links = links([(1, 10), (1, 11), (2, 10), (2, 11), (2, 12), (3, 10)])
+    assert tag_links.match("Image", [10]) == [1, 2, 3]
+    assert tag_links.match("Image", [10, 11]) == [1, 2]
+    assert tag_links.match("Image", [10, 11, 13]) == []
+    assert tag_links.match("Image", []) == []
+    assert tag_links.match_any("Image", [11, 12]) == {1, 2}
+    assert tag_links.counts("Image") == {10: 3, 11: 2, 12: 1}
+    assert tag_links.remaining("Image", [1, 2]) == {10: 2, 11: 2, 12: 1}
+
+
+def test_apply():
+    tag_links = links([(1, 10), (2, 10)])
+    tag_links.apply("Image", [(3, 10), (1, 11)], [(2, 10)])
+    assert tag_links.match("Image", [10]) == [1, 3]
+    assert tag_links.match("Image", [11]) == [1]
+    assert list(tag_links.tags["Image"][1]) == [10, 11]
+    assert 2 not in tag_links.tags["Image"]
+
+    tag_links.apply("Image", [], [(1, 11)])
+    assert 11 not in tag_links.objects["Image"]
+
+
+def test_apply_removes_duplicates_first():
+    # Linked by two users, so it stays linked until both links are removed
+    tag_links = links([(1, 10), (1, 10)])
+    tag_links.apply("Image", [], [(1, 10)])
+    assert tag_links.match("Image", [10]) == [1]
+    tag_links.apply("Image", [], [(1, 10)])
+    assert tag_links.match("Image", [10]) == []
+
+
+def test_apply_added_then_removed():
+    # Links are saved before any are deleted, so a link added by one user and
+    # removed by another in the same change is still linked
+    tag_links = links([(1, 10)])
+    tag_links.apply("Image", [(1, 10)], [(1, 10)])
+    assert tag_links.match("Image", [10]) == [1]
+    assert tag_links.duplicates["Image"] == {}
+
+
+def test_apply_replay():
+    # A link added while loading may have been loaded already, so is not
+    # counted again when the change is replayed
+    tag_links = links([(1, 10)])
+    tag_links.apply("Image", [(1, 10), (2, 10)], [], replay=True)
+    assert tag_links.match("Image", [10]) == [1, 2]
+    assert tag_links.duplicates["Image"] == {}
+
+
+def test_apply_matches_sets():
+    r = random.Random(2)
+    tag_links = links([])
+    count = {}
+    for _ in range(1000):
+        added = [(r.randrange(50), r.randrange(5)) for _ in range(r.randrange(4))]
+        for pair in added:
+            count[pair] = count.get(pair, 0) + 1
+        removed = [
+            pair
+            for pair in set((r.randrange(50), r.randrange(5)) for _ in range(3))
+            if count.get(pair)
+        ]
+        for pair in removed:
+            count[pair] -= 1
+        tag_links.apply("Image", added, removed)
+
+    linked = set(pair for pair, n in count.items() if n)
+    for tag_id in range(5):
+        expected = sorted(obj_id for obj_id, t in linked if t == tag_id)
+        assert tag_links.match("Image", [tag_id]) == expected
+    for obj_id, ids in tag_links.tags["Image"].items():
+        assert list(ids) == sorted(t for o, t in linked if o == obj_id)
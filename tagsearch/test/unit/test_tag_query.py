@@ -0,0 +1,74 @@
+"""
+Planning and evaluation of boolean tag queries
+"""
+
+from omero_webtagging_tagsearch.tag_links import TagLinks
+from omero_webtagging_tagsearch.tag_query import (
+    TagQuery,
+    evaluate,
+    index_fetcher,
+    plan,
+)
+
+LINKS = [(1, 10), (1, 11), (2, 10), (2, 12), (3, 10), (3, 11), (3, 13), (4, 11)]
+
+
+def fetcher():
+    tag_links = TagLinks()
+    tag_links.extend("Image", LINKS)
+    tag_links.sort("Image")
+    return index_fetcher(tag_links, "Image")
+
+
+def search(**terms):
+    query = TagQuery(**terms)
+    counts = {10: 3, 11: 3, 12: 1, 13: 1}
+    return evaluate(plan(query, counts), fetcher())
+
+
+def test_tag_query():
+    query = TagQuery(all_tags=[2, 1, 2])
+    assert query.all_tags == [1, 2]
+    assert query.is_conjunctive() and query.is_valid()
+    assert not TagQuery(all_tags=[1], none_tags=[2]).is_conjunctive()
+    assert TagQuery(any_tags=[1]).is_valid()
+    assert not TagQuery(none_tags=[1]).is_valid()
+
+
+def test_plan_most_selective_first():
+    query = TagQuery(all_tags=[1, 2], any_tags=[3, 4], none_tags=[5])
+    steps = plan(query, {1: 100, 2: 5, 3: 10, 4: 20, 5: 1})
+    assert steps == [("all", [2]), ("any", [3, 4]), ("all", [1]), ("none", [5])]
+
+
+def test_plan_unknown_tags_first():
+    # Estimated to match nothing, so evaluated first rather than trusted
+    steps = plan(TagQuery(all_tags=[1, 2]), {1: 100})
+    assert steps == [("all", [2]), ("all", [1])]
+
+
+def test_evaluate():
+    assert search(all_tags=[10, 11]) == [1, 3]
+    assert search(any_tags=[12, 13]) == [2, 3]
+    assert search(all_tags=[10], any_tags=[11, 12]) == [1, 2, 3]
+    assert search(all_tags=[10], none_tags=[13]) == [1, 2]
+    assert search(any_tags=[11], none_tags=[10]) == [4]
+    assert search(all_tags=[10, 14]) == []
+
+
+def test_evaluate_stops_when_nothing_matches():
+    fetched = []
+
+    def fetch(tag_ids, candidates):
+        fetched.append(tag_ids)
+        return set()
+
+    steps = [("all", [1]), ("all", [2]), ("none", [3])]
+    assert evaluate(steps, fetch) == []
+    assert fetched == [[1]]
+
+
+def test_index_fetcher_restricts_to_candidates():
+    fetch = fetcher()
+    assert fetch([10], None) == {1, 2, 3}
+    assert fetch([10, 11], {2, 4, 5}) == {2, 4}
@@ -0,0 +1,39 @@
+"""
+Check that the templates of the app compile
+
+Needs omero-web, and OMERODIR set as it is for OMERO.web, as the templates use
+OMERO.web's template tags and filters
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip("omeroweb")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "omeroweb.settings")
+
+import django  # noqa: E402
+from django.template import Engine, engines  # noqa: E402
+
+TEMPLATES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "omero_webtagging_tagsearch",
+    "templates",
+)
+
+
+@pytest.fixture(scope="module")
+def engine():
+    django.setup()
+    # The tags and filters of OMERO.web with the templates of the app, which
+    # need not be installed
+    omeroweb_engine = engines["django"].engine
+    return Engine(
+        dirs=[TEMPLATES],
+        builtins=omeroweb_engine.builtins,
+        libraries=omeroweb_engine.libraries,
+    )
+
+
+def test_search_details(engine):
+    engine.get_template("omero_webtagging_tagsearch/search_details.html")